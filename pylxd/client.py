@@ -14,9 +14,11 @@
 import json
 import os
 import os.path
+import threading
 
 import requests
 import requests_unixsocket
+from six.moves import queue
 from six.moves.urllib import parse
 try:
     from ws4py.client import WebSocketBaseClient
@@ -26,6 +28,7 @@ except ImportError:  # pragma: no cover
     _ws4py_installed = False
 
 from pylxd import exceptions, managers
+from pylxd.reactor import WebsocketReactor
 
 requests_unixsocket.monkeypatch()
 
@@ -100,7 +103,13 @@ class _APINode(object):
         """Perform an HTTP GET."""
         response = self.session.get(
             self._api_endpoint, *args, **kwargs)
-        self._assert_response(response, stream=kwargs.get('stream', False))
+        # A ranged request may be answered with partial content.
+        allowed_status_codes = (200,)
+        if 'Range' in (kwargs.get('headers') or {}):
+            allowed_status_codes = (200, 206)
+        self._assert_response(
+            response, allowed_status_codes=allowed_status_codes,
+            stream=kwargs.get('stream', False))
         return response
 
     def post(self, *args, **kwargs):
@@ -141,6 +150,30 @@ class _WebsocketClient(WebSocketBaseClient):
         self.messages.append(json_message)
 
 
+class _EventsWebsocketClient(WebSocketBaseClient):
+    """A websocket client that dispatches events from a reactor.
+
+    Each event is passed to `handler` if one is given, or otherwise put
+    on the `queue` attribute.
+    """
+
+    def __init__(self, reactor, url, handler=None):
+        self.reactor = reactor
+        self.handler = handler
+        self.queue = queue.Queue()
+        super(_EventsWebsocketClient, self).__init__(url)
+
+    def handshake_ok(self):
+        self.reactor.add(self)
+
+    def received_message(self, message):
+        event = json.loads(message.data.decode('utf-8'))
+        if self.handler is not None:
+            self.handler(event)
+        else:
+            self.queue.put(event)
+
+
 class Client(object):
     """Client class for LXD REST API.
 
@@ -165,6 +198,11 @@ class Client(object):
 
         Instance of :class:`Client.Profiles <pylxd.client.Client.Profiles>`.
 
+    .. attribute:: image_cache
+
+        An optional :class:`ImageCache <pylxd.image_cache.ImageCache>`,
+        which image exports and copies consult before going to LXD.
+
     .. attribute:: api
 
         This attribute provides tree traversal syntax to LXD's REST API for
@@ -187,8 +225,12 @@ class Client(object):
         os.path.expanduser('~/.config/lxc/client.crt'),
         os.path.expanduser('~/.config/lxc/client.key'))
 
-    def __init__(self, endpoint=None, version='1.0', cert=None, verify=True):
+    def __init__(self, endpoint=None, version='1.0', cert=None, verify=True,
+                 image_cache=None):
         self.cert = cert
+        self.image_cache = image_cache
+        self._reactor = None
+        self._reactor_lock = threading.Lock()
         if endpoint is not None:
             if endpoint.startswith('/') and os.path.isfile(endpoint):
                 self.api = _APINode('http+unix://{}'.format(
@@ -257,6 +299,34 @@ class Client(object):
         url = parse.urlunparse((scheme, host, '', '', '', ''))
         return url
 
+    @property
+    def reactor(self):
+        """The `WebsocketReactor` serving this client's websockets.
+
+        It is created on first use.
+        """
+        with self._reactor_lock:
+            if self._reactor is None:
+                self._reactor = WebsocketReactor()
+        return self._reactor
+
+    def watch_events(self, handler=None):
+        """Watch for events, without a thread of their own.
+
+        The events websocket is served by the client's reactor. Each event,
+        decoded from JSON, is passed to `handler` if given, or otherwise
+        put on the `queue` attribute of the returned websocket client. Call
+        its `close` method to stop watching.
+        """
+        if not _ws4py_installed:
+            raise ValueError(
+                'This feature requires the optional ws4py library.')
+        client = _EventsWebsocketClient(
+            self.reactor, self.websocket_url, handler=handler)
+        client.resource = parse.urlparse(self.api.events._api_endpoint).path
+        client.connect()
+        return client
+
     def events(self, websocket_client=None):
         """Get a websocket client for getting events.
 
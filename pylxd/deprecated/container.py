@@ -13,6 +13,7 @@
 #    under the License.
 
 import json
+import os
 
 from pylxd.deprecated import base
 from pylxd.deprecated import exceptions
@@ -146,13 +147,16 @@ class LXDContainer(base.LXDBase):
 
     def put_container_file(self, container, src_file,
                            dst_file, uid, gid, mode):
+        # Pass the open file as the body, so that it is streamed rather
+        # than read into memory.
         with open(src_file, 'rb') as f:
-            data = f.read()
-        return self.connection.get_object(
-            'POST',
-            '/1.0/containers/%s/files?path=%s' % (container, dst_file),
-            body=data,
-            headers={'X-LXD-uid': uid, 'X-LXD-gid': gid, 'X-LXD-mode': mode})
+            return self.connection.get_object(
+                'POST',
+                '/1.0/containers/%s/files?path=%s' % (container, dst_file),
+                body=f,
+                headers={
+                    'X-LXD-uid': uid, 'X-LXD-gid': gid, 'X-LXD-mode': mode,
+                    'Content-Length': str(os.fstat(f.fileno()).st_size)})
 
     def container_publish(self, container):
         return self.connection.get_object('POST', '/1.0/images',
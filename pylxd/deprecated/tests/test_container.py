@@ -142,6 +142,8 @@ class LXDAPIContainerTestObject(LXDAPITestBase):
 
     def test_container_put_file(self, ms):
         temp_file = tempfile.NamedTemporaryFile()
+        temp_file.write(b'data')
+        temp_file.flush()
         ms.return_value = ('200', fake_api.fake_standard_return())
         self.assertEqual(
             ms.return_value, self.lxd.put_container_file('trusty-1',
@@ -150,8 +152,10 @@ class LXDAPIContainerTestObject(LXDAPITestBase):
         ms.assert_called_once_with(
             'POST',
             '/1.0/containers/trusty-1/files?path=dst_file',
-            body=b'',
-            headers={'X-LXD-gid': 0, 'X-LXD-mode': 0o644, 'X-LXD-uid': 0})
+            body=mock.ANY,
+            headers={'X-LXD-gid': 0, 'X-LXD-mode': 0o644, 'X-LXD-uid': 0,
+                     'Content-Length': '4'})
+        self.assertEqual(temp_file.name, ms.call_args[1]['body'].name)
 
     def test_list_snapshots(self, ms):
         ms.return_value = ('200', fake_api.fake_snapshots_list())
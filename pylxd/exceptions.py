@@ -32,3 +32,38 @@ class NotFound(LXDAPIException):
 
 class ClientConnectionFailed(Exception):
     """An exception raised when the Client connection fails."""
+
+
+class ContainerCommandFailed(Exception):
+    """An exception raised when a command run by pylxd in a container fails.
+
+    Some operations, such as copying directory trees, are carried out by
+    running commands in the container. The result of the failed command
+    is available as `result`.
+    """
+
+    def __init__(self, commands, result):
+        super(ContainerCommandFailed, self).__init__()
+        self.commands = commands
+        self.result = result
+
+    def __str__(self):
+        return 'Command {} failed with exit code {}: {}'.format(
+            self.commands, self.result.exit_code, self.result.stderr)
+
+
+class ImageFingerprintMismatch(Exception):
+    """An exception raised when image data doesn't match its fingerprint.
+
+    The fingerprint LXD gave the image is `fingerprint`, and the SHA-256
+    of the data that was actually received is `actual`.
+    """
+
+    def __init__(self, fingerprint, actual):
+        super(ImageFingerprintMismatch, self).__init__()
+        self.fingerprint = fingerprint
+        self.actual = actual
+
+    def __str__(self):
+        return 'Expected image {}, but got data with fingerprint {}'.format(
+            self.fingerprint, self.actual)
@@ -0,0 +1,149 @@
+# Copyright (c) 2016 Canonical Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import contextlib
+import os
+import tempfile
+import threading
+
+
+class ImageCache(object):
+    """A local cache of exported images, keyed by fingerprint.
+
+    A `Client` given an image cache consults it before exporting an image
+    from LXD, and before copying one to another host, so an image that has
+    been exported once is read from local disk from then on.
+
+    Each image is kept in `directory`, as a single file named after its
+    fingerprint, or, for a split image, as `<fingerprint>.metadata` and
+    `<fingerprint>.rootfs`. Entries are written to temporary files and
+    renamed into place, so a partially written image is never seen. When
+    the cache grows beyond `max_size` bytes, the least recently used
+    images are removed.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _paths(self, fingerprint):
+        path = os.path.join(self.directory, fingerprint)
+        return path, path + '.metadata', path + '.rootfs'
+
+    def get(self, fingerprint):
+        """Return the cached files of an image, or None.
+
+        The files are returned as a `(path, rootfs_path)` pair. For a split
+        image, `path` is the metadata tarball; otherwise `rootfs_path` is
+        None. The files may be evicted at any time after this returns; to
+        read them, use `open`.
+        """
+        with self._lock:
+            return self._get(fingerprint)
+
+    def open(self, fingerprint):
+        """Open the cached files of an image, or return None.
+
+        Like `get`, but returns a `(file, rootfs_file)` pair of file
+        objects opened in binary mode, which the caller must close. They
+        are opened while the cache is locked, so they can still be read if
+        the image is evicted afterwards.
+        """
+        with self._lock:
+            entry = self._get(fingerprint)
+            if entry is None:
+                return None
+            path, rootfs_path = entry
+            f = open(path, 'rb')
+            if rootfs_path is None:
+                return f, None
+            try:
+                return f, open(rootfs_path, 'rb')
+            except BaseException:
+                f.close()
+                raise
+
+    def _get(self, fingerprint):
+        path, metadata_path, rootfs_path = self._paths(fingerprint)
+        if os.path.exists(path):
+            entry = (path, None)
+        elif os.path.exists(metadata_path) and os.path.exists(rootfs_path):
+            entry = (metadata_path, rootfs_path)
+        else:
+            return None
+        # The modification time records when the entry was last used.
+        for each in entry:
+            if each is not None:
+                os.utime(each, None)
+        return entry
+
+    def __contains__(self, fingerprint):
+        return self.get(fingerprint) is not None
+
+    @contextlib.contextmanager
+    def writing(self, fingerprint):
+        """Add an image to the cache.
+
+        Yields a `(path, rootfs_path)` pair of temporary paths. Write the
+        image to `path`, or a split image's metadata to `path` and its
+        rootfs to `rootfs_path`. When the block exits, the files are moved
+        into the cache, unless it raised an exception, in which case they
+        are removed.
+        """
+        fd, path = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        os.close(fd)
+        rootfs_path = path + '.rootfs'
+        try:
+            yield path, rootfs_path
+        except BaseException:
+            for each in (path, rootfs_path):
+                if os.path.exists(each):
+                    os.remove(each)
+            raise
+
+        final, final_metadata, final_rootfs = self._paths(fingerprint)
+        with self._lock:
+            if os.path.exists(rootfs_path):
+                # The rootfs goes first, as an entry is only complete
+                # once its metadata exists.
+                os.rename(rootfs_path, final_rootfs)
+                os.rename(path, final_metadata)
+            else:
+                os.rename(path, final)
+            self._evict(keep=fingerprint)
+
+    def _evict(self, keep):
+        """Remove the least recently used images, other than `keep`."""
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp-'):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            mtime, size, names = entries.get(
+                name.split('.')[0], (0, 0, []))
+            entries[name.split('.')[0]] = (
+                max(mtime, stat.st_mtime), size + stat.st_size,
+                names + [name])
+        size = sum(entry[1] for entry in entries.values())
+        for fingerprint, (_, entry_size, names) in sorted(
+                entries.items(), key=lambda item: item[1][0]):
+            if size <= self.max_size:
+                break
+            if fingerprint == keep:
+                continue
+            for name in names:
+                os.remove(os.path.join(self.directory, name))
+            size -= entry_size
@@ -0,0 +1,67 @@
+# Copyright (c) 2016 Canonical Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Helpers for running operations against many objects at once."""
+import threading
+
+from six.moves import queue
+
+
+def imap_unordered(func, items, concurrency, join=False):
+    """Call `func` on each of `items`, using up to `concurrency` threads.
+
+    Yields `(item, result)` pairs in the order the calls complete. If a
+    call raises an exception, the exception is yielded as its result, so
+    that one failure doesn't abandon the rest of the work.
+
+    If the caller stops iterating early, no more calls are started. If
+    `join` is true, the calls in progress are also waited for, so that
+    anything they use can be safely released afterwards.
+    """
+    items = list(items)
+    if not items:
+        return
+    pending = queue.Queue()
+    for item in items:
+        pending.put(item)
+    done = queue.Queue()
+    stopped = threading.Event()
+
+    def worker():
+        while not stopped.is_set():
+            try:
+                item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result = func(item)
+            except Exception as e:
+                result = e
+            done.put((item, result))
+
+    threads = []
+    for _ in range(min(concurrency, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    try:
+        for _ in items:
+            yield done.get()
+    finally:
+        # If the caller stops iterating early, don't start any more work.
+        stopped.set()
+        if join:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,589 @@
+# Copyright (c) 2016 Canonical Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Helpers for streaming data to and from LXD without buffering it."""
+import contextlib
+import hashlib
+import io
+import json
+import mmap
+import os
+import tarfile
+import threading
+import uuid
+
+import six
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Files at least this big are mapped into memory, rather than read.
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def iter_chunks(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterate over `source` as chunks of bytes.
+
+    `source` may be bytes (or text, which is encoded as utf-8), a file
+    object opened in binary mode, or an iterable of bytes. File objects
+    are read `chunk_size` bytes at a time; iterables are passed through
+    as-is.
+    """
+    if isinstance(source, six.text_type):
+        source = source.encode('utf-8')
+    if isinstance(source, six.binary_type):
+        for offset in six.moves.range(0, len(source), chunk_size):
+            yield source[offset:offset + chunk_size]
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def iter_response(response, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterate over the body of a streamed response, closing it after."""
+    with contextlib.closing(response):
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            yield chunk
+
+
+class _Readable(object):
+    """Give an iterable body a `read` method.
+
+    httplib on Python 2 sends any body without a `read` method in one
+    `sendall`, so bodies that should stream must be readable. Reading
+    starts again from the beginning after `rewind()`.
+    """
+
+    _chunks = None
+    _buffer = b''
+
+    def read(self, size=-1):
+        if self._chunks is None:
+            self._chunks = iter(self)
+        while size is None or size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def rewind(self):
+        """Read from the beginning of the body again."""
+        self._chunks = None
+        self._buffer = b''
+
+
+class Payload(_Readable):
+    """A body to upload, which can be read more than once.
+
+    `source` may be bytes (or text, which is encoded as utf-8, as
+    `iter_chunks` does) or a seekable file object opened in binary mode,
+    which is read from its current position. To upload a local file by
+    its path, use `Payload.from_path`. Iterating over the payload yields
+    its content in chunks, starting from the beginning each time, and
+    `len()` gives its size without reading it.
+    """
+
+    _path = None
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        if isinstance(source, six.text_type):
+            source = source.encode('utf-8')
+        self.source = source
+        self.chunk_size = chunk_size
+        if isinstance(source, six.binary_type):
+            self._size = len(source)
+        else:
+            if hasattr(source, 'seekable') and not source.seekable():
+                raise ValueError('File objects must be seekable.')
+            self._start = source.tell()
+            try:
+                end = os.fstat(source.fileno()).st_size
+            except (AttributeError, io.UnsupportedOperation):
+                source.seek(0, io.SEEK_END)
+                end = source.tell()
+                source.seek(self._start)
+            self._size = end - self._start
+
+    @classmethod
+    def from_path(cls, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Return a payload of the local file at `path`.
+
+        The file is opened each time the payload is iterated over.
+        """
+        payload = cls(b'', chunk_size)
+        payload._path = path
+        payload._size = os.path.getsize(path)
+        return payload
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        if self._path is not None:
+            with open(self._path, 'rb') as f:
+                for chunk in iter_chunks(f, self.chunk_size):
+                    yield chunk
+        elif isinstance(self.source, six.binary_type):
+            for chunk in iter_chunks(self.source, self.chunk_size):
+                yield chunk
+        else:
+            self.source.seek(self._start)
+            for chunk in iter_chunks(self.source, self.chunk_size):
+                yield chunk
+
+
+class MultipartEncoder(_Readable):
+    """A multipart/form-data body, streamed from its parts.
+
+    `fields` is a list of `(name, source)` pairs, where each `source` is
+    a `Payload`, or anything accepted by one. Like a `Payload`, the body
+    can be read more than once, and `len()` gives its exact size, so it
+    is sent with a Content-Length and never held in memory as a whole.
+    """
+
+    def __init__(self, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+        boundary = str(uuid.uuid1())
+        self.content_type = 'multipart/form-data;boundary={}'.format(
+            boundary)
+        self._parts = []
+        for name, source in fields:
+            header = b'\r\n'.join([
+                six.b('--{}'.format(boundary)),
+                six.b(
+                    'Content-Disposition:form-data;'
+                    'name={};filename={}'.format(name, name)),
+                b'Content-Type: application/octet-stream',
+                b'',
+                b'',
+            ])
+            if not isinstance(source, Payload):
+                source = Payload(source, chunk_size)
+            self._parts.append((header, source))
+        self._footer = six.b('--{}--\r\n\r\n'.format(boundary))
+
+    def __len__(self):
+        return sum(
+            len(header) + len(payload) + 2
+            for header, payload in self._parts) + len(self._footer)
+
+    def __iter__(self):
+        for header, payload in self._parts:
+            yield header
+            for chunk in payload:
+                yield chunk
+            yield b'\r\n'
+        yield self._footer
+
+
+class MultipartParser(object):
+    """Parse a multipart body as it streams.
+
+    The content of each part is written, as it arrives, to the file object
+    returned by `open_part(name)`, where `name` is the part's form field
+    name. Only as much of the body as might hold a boundary is buffered.
+    """
+
+    def __init__(self, boundary, open_part):
+        self._delimiter = b'\r\n--' + boundary
+        self._open_part = open_part
+        # The first boundary isn't preceded by a line break.
+        self._buffer = b'\r\n'
+        self._state = 'preamble'
+        self._part = None
+
+    def feed(self, chunk):
+        """Parse the next chunk of the body."""
+        self._buffer += chunk
+        while True:
+            if self._state in ('preamble', 'body'):
+                index = self._buffer.find(self._delimiter)
+                if index == -1:
+                    keep = len(self._delimiter) - 1
+                    if self._state == 'body' and len(self._buffer) > keep:
+                        self._part.write(self._buffer[:-keep])
+                    self._buffer = self._buffer[-keep:]
+                    return
+                if self._state == 'body':
+                    self._part.write(self._buffer[:index])
+                self._buffer = self._buffer[index + len(self._delimiter):]
+                self._state = 'boundary'
+            elif self._state == 'boundary':
+                if len(self._buffer) < 2:
+                    return
+                if self._buffer.startswith(b'--'):
+                    self._state = 'done'
+                    return
+                self._buffer = self._buffer[2:]
+                self._state = 'headers'
+            elif self._state == 'headers':
+                index = self._buffer.find(b'\r\n\r\n')
+                if index == -1:
+                    return
+                headers = self._buffer[:index].decode('utf-8')
+                self._buffer = self._buffer[index + 4:]
+                self._part = self._open_part(_part_name(headers))
+                self._state = 'body'
+            else:
+                return
+
+    def close(self):
+        """Check that the whole body was parsed."""
+        if self._state != 'done':
+            raise ValueError('The multipart body is incomplete.')
+
+
+def _part_name(headers):
+    """Return the form field name from the headers of a part."""
+    for line in headers.split('\r\n'):
+        header, _, value = line.partition(':')
+        if header.strip().lower() != 'content-disposition':
+            continue
+        for param in value.split(';'):
+            key, _, param_value = param.strip().partition('=')
+            if key == 'name':
+                return param_value.strip('"')
+    raise ValueError('A part of the multipart body has no name.')
+
+
+def multipart_boundary(content_type):
+    """Return the boundary of a multipart content type, or None."""
+    if not content_type or not content_type.startswith('multipart/'):
+        return None
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key == 'boundary':
+            return value.strip('"').encode('utf-8')
+    return None
+
+
+class OutputFiles(object):
+    """Files written from a stream, which are removed if the stream fails.
+
+    Use as a context manager: files opened by path are closed on exit, and
+    removed if an exception was raised. File objects are written to as
+    they are, and left open.
+    """
+
+    def __init__(self):
+        self._opened = []
+
+    def open(self, target):
+        """Return a file object for `target`, a path or a file object."""
+        if hasattr(target, 'write'):
+            return target
+        f = open(target, 'wb')
+        self._opened.append((target, f))
+        return f
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for path, f in self._opened:
+            f.close()
+            if exc_type is not None:
+                os.remove(path)
+
+
+def pwrite(fd, data, offset, lock):
+    """Write all of `data` to the file descriptor `fd` at `offset`.
+
+    Where `os.pwrite` isn't available, the file position is moved and
+    written to while holding `lock`, so concurrent writers don't race.
+    """
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data):]
+
+
+class HashingWriter(object):
+    """Wrap a file object, updating `hasher` with everything written.
+
+    If `f` is None, the data is only hashed.
+    """
+
+    def __init__(self, f, hasher):
+        self._f = f
+        self._hasher = hasher
+
+    def write(self, data):
+        self._hasher.update(data)
+        if self._f is not None:
+            return self._f.write(data)
+        return len(data)
+
+
+class HashCache(object):
+    """A cache of the SHA-256 digests of local files.
+
+    Digests are keyed by path, and only recomputed when a file's size or
+    modification time changes. If `path` is given, the cache is loaded
+    from and saved to that JSON file, so it survives between processes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def digest(self, filename):
+        """Return the hex SHA-256 digest of a local file."""
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        key = [stat.st_size, stat.st_mtime]
+        with self._lock:
+            entry = self._entries.get(filename)
+        if entry is not None and entry[:2] == key:
+            return entry[2]
+        sha256 = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter_chunks(f):
+                sha256.update(chunk)
+        with self._lock:
+            self._entries[filename] = key + [sha256.hexdigest()]
+        return sha256.hexdigest()
+
+    def save(self):
+        """Save the cache to its file, if it has one."""
+        if self.path is None:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        with open(self.path, 'w') as f:
+            json.dump(entries, f)
+
+
+#: The cache used when none is given, shared by the whole process.
+default_hash_cache = HashCache()
+
+
+class SharedSource(object):
+    """The content of a file, read once and shared by many uploads.
+
+    `source` may be bytes or a file object opened in binary mode, whose
+    content is taken from its current position. Large files with a
+    `fileno` are mapped read-only into memory, rather than read. Each
+    upload reads the content through its own `reader()`, so no copies of
+    the content are made.
+    """
+
+    def __init__(self, source):
+        self._mmap = None
+        self._start = 0
+        if isinstance(source, six.binary_type):
+            self.buffer = source
+        elif not hasattr(source, 'read'):
+            raise TypeError('The source must be bytes or a file object.')
+        else:
+            size = 0
+            try:
+                size = os.fstat(source.fileno()).st_size - source.tell()
+            except (AttributeError, IOError, OSError,
+                    io.UnsupportedOperation):
+                pass
+            if size >= MMAP_THRESHOLD:
+                self._start = source.tell()
+                self._mmap = mmap.mmap(
+                    source.fileno(), 0, access=mmap.ACCESS_READ)
+                self.buffer = self._mmap
+            else:
+                self.buffer = source.read()
+        sha256 = hashlib.sha256()
+        for start in six.moves.range(
+                self._start, len(self.buffer), DEFAULT_CHUNK_SIZE):
+            sha256.update(self.buffer[start:start + DEFAULT_CHUNK_SIZE])
+        self.sha256 = sha256.hexdigest()
+
+    def reader(self):
+        """Return a new file object reading the content."""
+        return BufferReader(self.buffer, self._start)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BufferReader(io.RawIOBase):
+    """A read-only file object over a shared buffer, such as an mmap.
+
+    The file starts at offset `start` of the buffer.
+    """
+
+    def __init__(self, buffer, start=0):
+        super(BufferReader, self).__init__()
+        self._buffer = buffer
+        self._start = start
+        self._position = 0
+
+    def __len__(self):
+        return len(self._buffer) - self._start
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self)
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self) - self._position
+        start = self._start + self._position
+        data = self._buffer[start:start + size]
+        self._position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class TarWriter(threading.Thread):
+    """Write a tar archive of a local directory to a pipe.
+
+    The archive is read from the `reader` file object as it is written
+    by the thread, so it never exists as a whole, in memory or on disk.
+    If `paths` is given, only those paths, relative to `local_dir`, are
+    archived. Members are owned by root, whoever owns the local files, and
+    the root directory itself isn't archived. Any exception raised while
+    archiving is stored as `error`.
+    """
+
+    def __init__(self, local_dir, paths=None):
+        super(TarWriter, self).__init__()
+        self.daemon = True
+        self.local_dir = local_dir
+        self.paths = paths
+        self.error = None
+        read, write = os.pipe()
+        self.reader = os.fdopen(read, 'rb')
+        self._writer = os.fdopen(write, 'wb')
+
+    def run(self):
+        try:
+            with self._writer:
+                tar = tarfile.open(fileobj=self._writer, mode='w|')
+                with contextlib.closing(tar):
+                    if self.paths is None:
+                        # The root itself isn't archived, so extracting
+                        # leaves the mode and owner of the target alone.
+                        for name in sorted(os.listdir(self.local_dir)):
+                            tar.add(
+                                os.path.join(self.local_dir, name),
+                                arcname=name, filter=_root_owned)
+                    for path in self.paths or []:
+                        tar.add(
+                            os.path.join(self.local_dir, path),
+                            arcname=path, recursive=False,
+                            filter=_root_owned)
+        except Exception as e:
+            self.error = e
+
+
+def _root_owned(info):
+    """Give a tar member to root, as the files API does."""
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    return info
+
+
+class TarExtractor(threading.Thread):
+    """Extract a tar archive written to a pipe into a local directory.
+
+    The archive is written to the `writer` file object, which must be
+    closed once the archive is complete. Members that would be extracted
+    outside of `local_dir` are skipped. Any exception raised while
+    extracting is stored as `error`.
+    """
+
+    def __init__(self, local_dir):
+        super(TarExtractor, self).__init__()
+        self.daemon = True
+        self.local_dir = local_dir
+        self.error = None
+        read, write = os.pipe()
+        self._reader = os.fdopen(read, 'rb')
+        self.writer = os.fdopen(write, 'wb')
+
+    def _members(self, tar):
+        root = os.path.realpath(self.local_dir)
+        for member in tar:
+            path = os.path.realpath(os.path.join(root, member.name))
+            if path != root and not path.startswith(root + os.sep):
+                continue
+            if member.issym() or member.islnk():
+                target = os.path.realpath(os.path.join(
+                    os.path.dirname(path) if member.issym() else root,
+                    member.linkname))
+                if not target.startswith(root + os.sep):
+                    continue
+            if member.isdev():
+                continue
+            yield member
+
+    def run(self):
+        kwargs = {}
+        if hasattr(tarfile, 'data_filter'):
+            kwargs['filter'] = 'data'
+        try:
+            with self._reader:
+                try:
+                    tar = tarfile.open(fileobj=self._reader, mode='r|')
+                    with contextlib.closing(tar):
+                        tar.extractall(
+                            self.local_dir, members=self._members(tar),
+                            **kwargs)
+                finally:
+                    # Drain anything left, such as the archive's padding, or
+                    # everything after an error, so the writer never blocks.
+                    while self._reader.read(DEFAULT_CHUNK_SIZE):
+                        pass
+        except Exception as e:
+            self.error = e
@@ -11,21 +11,34 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import codecs
 import collections
+import contextlib
+import io
+import json
+import os
+import posixpath
+import signal
+import tempfile
+import threading
 import time
+import uuid
 
 import six
+from six.moves import shlex_quote
 from six.moves.urllib import parse
 try:
     from ws4py.client import WebSocketBaseClient
-    from ws4py.manager import WebSocketManager
     _ws4py_installed = True
 except ImportError:  # pragma: no cover
     WebSocketBaseClient = object
     _ws4py_installed = False
 
-from pylxd import managers
-from pylxd.models import _model as model
+from pylxd import exceptions, managers
+from pylxd.models import _model as model, _parallel, _stream
+
+# How long to wait for the exit code of a command killed on timeout.
+KILL_TIMEOUT = 5
 
 
 class ContainerState(object):
@@ -36,9 +49,20 @@ class ContainerState(object):
             setattr(self, key, value)
 
 
-_ContainerExecuteResult = collections.namedtuple(
-    'ContainerExecuteResult',
-    ['exit_code', 'stdout', 'stderr'])
+class _ContainerExecuteResult(collections.namedtuple(
+        'ContainerExecuteResult', ['exit_code', 'stdout', 'stderr'])):
+    """The result of executing a command.
+
+    `timed_out` is True if the command was killed for exceeding its
+    timeout. It isn't part of the tuple, so that unpacking the result
+    into `(exit_code, stdout, stderr)` keeps working.
+    """
+
+    def __new__(cls, exit_code, stdout, stderr, timed_out=False):
+        result = super(_ContainerExecuteResult, cls).__new__(
+            cls, exit_code, stdout, stderr)
+        result.timed_out = timed_out
+        return result
 
 
 class Container(model.Model):
@@ -78,17 +102,273 @@ class Container(model.Model):
             self._container = container
 
         def put(self, filepath, data):
+            """Push a file to the container.
+
+            `data` may be bytes, or a file object opened in binary mode,
+            which is streamed, or an iterable of bytes, which is sent with
+            chunked encoding. Either way, the file is never held in memory
+            as a whole.
+            """
+            if not (isinstance(data, (six.binary_type, six.text_type)) or
+                    hasattr(data, 'read')):
+                data = _stream.iter_chunks(data)
             response = self._client.api.containers[
                 self._container.name].files.post(
                 params={'path': filepath}, data=data)
             return response.status_code == 200
 
+        def upload(self, filepath, source_path):
+            """Stream the local file at `source_path` to the container."""
+            with open(source_path, 'rb') as f:
+                return self.put(filepath, f)
+
         def get(self, filepath):
             response = self._client.api.containers[
                 self._container.name].files.get(
                 params={'path': filepath})
             return response.content
 
+        def get_stream(self, filepath, chunk_size=_stream.DEFAULT_CHUNK_SIZE):
+            """Get a file from the container as an iterator of chunks.
+
+            The file is read from LXD as the iterator is consumed, so it is
+            never held in memory as a whole.
+            """
+            response = self._client.api.containers[
+                self._container.name].files.get(
+                params={'path': filepath}, stream=True)
+            return _stream.iter_response(response, chunk_size)
+
+        def download(self, filepath, dest,
+                     chunk_size=_stream.DEFAULT_CHUNK_SIZE):
+            """Stream a file from the container to `dest`.
+
+            `dest` may be a local path, or a file object opened for writing
+            in binary mode. If the download of a path fails, the partial
+            file is removed.
+            """
+            chunks = self.get_stream(filepath, chunk_size=chunk_size)
+            if hasattr(dest, 'write'):
+                for chunk in chunks:
+                    dest.write(chunk)
+                return
+            try:
+                with open(dest, 'wb') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            except Exception:
+                if os.path.exists(dest):
+                    os.remove(dest)
+                raise
+
+        def push_tree(self, local_dir, remote_dir, concurrency=10):
+            """Copy a local directory tree into the container.
+
+            The tree is streamed as a tar archive to `tar` in the container,
+            in a single exec. If the container has no `tar` (or ws4py is
+            not installed), the directories are created one by one, and the
+            files uploaded with up to `concurrency` requests at once.
+            """
+            if self._has_tar():
+                self._push_tar(local_dir, remote_dir)
+            else:
+                self._push_files(local_dir, remote_dir, concurrency)
+
+        def pull_tree(self, remote_dir, local_dir, concurrency=10):
+            """Copy a directory tree from the container to a local directory.
+
+            The tree is streamed as a tar archive from `tar` in the
+            container, in a single exec, and members that would land
+            outside `local_dir` are skipped. If the container has no `tar`
+            (or ws4py is not installed), the tree is walked through the
+            files API instead, with up to `concurrency` requests at once;
+            symlinks are skipped in that case.
+            """
+            if self._has_tar():
+                self._pull_tar(remote_dir, local_dir)
+            else:
+                self._pull_files(remote_dir, local_dir, concurrency)
+
+        def sync_tree(self, local_dir, remote_dir, concurrency=10,
+                      cache_file=None):
+            """Copy only the files that differ from a local tree.
+
+            The SHA-256 digests of the files under `remote_dir` are
+            fetched with a single `sha256sum` exec, and compared with the
+            digests of the local files, which are cached by size and
+            modification time, in memory or, if `cache_file` is given, in
+            that JSON file. Files that are missing or differ are copied in
+            one tar stream, or, if the container has no `tar`, uploaded
+            with up to `concurrency` requests at once.
+            Remote files that don't exist locally are left alone.
+
+            Returns the paths, relative to `local_dir`, that were copied.
+            """
+            if cache_file is None:
+                hash_cache = _stream.default_hash_cache
+            else:
+                hash_cache = _stream.HashCache(cache_file)
+            has_tar, remote = self._remote_digests(remote_dir)
+
+            changed = []
+            for root, _, filenames in os.walk(local_dir):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    relative = '/'.join(
+                        os.path.relpath(path, local_dir).split(os.sep))
+                    if remote.get(relative) != hash_cache.digest(path):
+                        changed.append(relative)
+            hash_cache.save()
+            if not changed:
+                return changed
+
+            if has_tar and _ws4py_installed:
+                self._push_tar(local_dir, remote_dir, paths=changed)
+                return changed
+            directories = set()
+            for relative in changed:
+                parent = posixpath.dirname(relative)
+                while parent not in directories:
+                    directories.add(parent)
+                    parent = posixpath.dirname(parent)
+            for directory in sorted(directories):
+                self._mkdir(posixpath.normpath(
+                    posixpath.join(remote_dir, directory)))
+            for _, result in _parallel.imap_unordered(
+                    lambda relative: self.upload(
+                        posixpath.join(remote_dir, relative),
+                        os.path.join(local_dir, *relative.split('/'))),
+                    changed, concurrency):
+                if isinstance(result, Exception):
+                    raise result
+            return changed
+
+        def _remote_digests(self, remote_dir):
+            """Return whether tar is available, and the digests of files.
+
+            Digests are keyed by path relative to `remote_dir`.
+            """
+            commands = [
+                'sh', '-c',
+                'command -v tar >/dev/null 2>&1 && echo tar; '
+                'if [ -d "$1" ]; then '
+                'cd "$1" && find . -type f -exec sha256sum {} +; fi',
+                'sh', remote_dir]
+            result = self._container.execute(commands, record_output=True)
+            if result.exit_code != 0:
+                raise exceptions.ContainerCommandFailed(commands, result)
+            lines = result.stdout.splitlines()
+            has_tar = bool(lines) and lines[0] == 'tar'
+            digests = {}
+            for line in lines[1 if has_tar else 0:]:
+                digest, _, path = line.partition('  ')
+                if path.startswith('./'):
+                    digests[path[2:]] = digest
+            return has_tar, digests
+
+        def _has_tar(self):
+            if not _ws4py_installed:
+                return False
+            try:
+                result = self._container.execute(
+                    ['sh', '-c', 'command -v tar'], record_output=True)
+            except exceptions.LXDAPIException:
+                return False
+            return result.exit_code == 0
+
+        def _push_tar(self, local_dir, remote_dir, paths=None):
+            commands = [
+                'sh', '-c', 'mkdir -p "$1" && exec tar -x -f - -C "$1"',
+                'sh', remote_dir]
+            writer = _stream.TarWriter(local_dir, paths)
+            writer.start()
+            with writer.reader:
+                result = self._container.execute(
+                    commands, stdin_payload=writer.reader)
+            writer.join()
+            if result.exit_code != 0:
+                raise exceptions.ContainerCommandFailed(commands, result)
+            if writer.error is not None:
+                raise writer.error
+
+        def _mkdir(self, path):
+            self._client.api.containers[self._container.name].files.post(
+                params={'path': path}, headers={'X-LXD-type': 'directory'})
+
+        def _push_files(self, local_dir, remote_dir, concurrency):
+            files = []
+            for root, _, filenames in os.walk(local_dir):
+                relative = os.path.relpath(root, local_dir)
+                remote_root = posixpath.normpath(posixpath.join(
+                    remote_dir, *relative.split(os.sep)))
+                # os.walk is top down, so parents are created first.
+                self._mkdir(remote_root)
+                for filename in filenames:
+                    files.append((
+                        posixpath.join(remote_root, filename),
+                        os.path.join(root, filename)))
+            for _, result in _parallel.imap_unordered(
+                    lambda paths: self.upload(*paths), files, concurrency):
+                if isinstance(result, Exception):
+                    raise result
+
+        def _pull_tar(self, remote_dir, local_dir):
+            commands = ['tar', '-c', '-f', '-', '-C', remote_dir, '.']
+            if not os.path.isdir(local_dir):
+                os.makedirs(local_dir)
+            extractor = _stream.TarExtractor(local_dir)
+            extractor.start()
+            try:
+                result = self._container.execute(
+                    commands, decode=False,
+                    stdout_handler=extractor.writer.write)
+            finally:
+                extractor.writer.close()
+            extractor.join()
+            if result.exit_code != 0:
+                raise exceptions.ContainerCommandFailed(commands, result)
+            if extractor.error is not None:
+                raise extractor.error
+
+        def _pull_files(self, remote_dir, local_dir, concurrency):
+            # Walk the tree a level at a time, fetching the entries of each
+            # level concurrently.
+            pending = [(remote_dir, local_dir)]
+            while pending:
+                children = []
+                for _, result in _parallel.imap_unordered(
+                        lambda paths: self._pull_entry(*paths), pending,
+                        concurrency):
+                    if isinstance(result, Exception):
+                        raise result
+                    children.extend(result)
+                pending = children
+
+        def _pull_entry(self, remote_path, local_path):
+            """Fetch a file, or create a directory and list its entries."""
+            response = self._client.api.containers[
+                self._container.name].files.get(
+                params={'path': remote_path}, stream=True)
+            file_type = response.headers.get('X-LXD-type', 'file')
+            if file_type == 'directory':
+                with contextlib.closing(response):
+                    names = response.json()['metadata']
+                if not os.path.isdir(local_path):
+                    os.makedirs(local_path)
+                return [
+                    (posixpath.join(remote_path, name),
+                     os.path.join(local_path, name))
+                    for name in names
+                    if name not in ('.', '..') and '/' not in name and
+                    os.sep not in name]
+            if file_type == 'file':
+                with open(local_path, 'wb') as f:
+                    for chunk in _stream.iter_response(response):
+                        f.write(chunk)
+            else:
+                response.close()
+            return []
+
     @classmethod
     def exists(cls, client, name):
         """Determine whether a container exists."""
@@ -132,6 +412,94 @@ class Container(model.Model):
             client.operations.wait_for_operation(response.json()['operation'])
         return cls(client, name=config['name'])
 
+    @classmethod
+    def execute_many(cls, client, containers, commands, concurrency=10,
+                     **kwargs):
+        """Execute a command on many containers concurrently.
+
+        `containers` may be container names or `Container` objects. Up to
+        `concurrency` commands are run at once, with their websockets all
+        served by the client's websocket reactor. Other keyword arguments
+        are passed to `Container.execute`.
+
+        Yields `(container, result)` pairs as each command completes. If
+        executing the command fails, the exception is yielded in place of
+        the result.
+        """
+        if not _ws4py_installed and not kwargs.get('record_output'):
+            raise ValueError(
+                'This feature requires the optional ws4py library.')
+        if isinstance(commands, six.string_types):
+            raise TypeError("First argument must be a list.")
+        containers = [
+            cls(client, name=container)
+            if isinstance(container, six.string_types) else container
+            for container in containers]
+
+        return cls._execute_many(containers, commands, concurrency, kwargs)
+
+    @staticmethod
+    def _execute_many(containers, commands, concurrency, kwargs):
+        for container, result in _parallel.imap_unordered(
+                lambda container: container.execute(commands, **kwargs),
+                containers, concurrency):
+            yield container, result
+
+    @classmethod
+    def put_file_many(cls, client, targets, filepath, source, concurrency=10,
+                      skip_matching=False):
+        """Push the same file to many containers concurrently.
+
+        `targets` may be container names or `Container` objects. `source`
+        may be bytes or a file object opened in binary mode, read from its
+        current position; it is read and hashed once, with large files
+        mapped into memory, and the content is shared by all of the
+        uploads, up to `concurrency` of which run at once.
+
+        If `skip_matching` is true, the SHA-256 digest of `filepath` is
+        first read in each container with `sha256sum`, and the upload is
+        skipped if it already matches.
+
+        Yields `(container, status)` pairs as each target completes, where
+        `status` is `'uploaded'` or `'skipped'`. If pushing the file fails,
+        the exception is yielded in place of the status.
+        """
+        targets = [
+            cls(client, name=target)
+            if isinstance(target, six.string_types) else target
+            for target in targets]
+
+        return cls._put_file_many(
+            targets, filepath, _stream.SharedSource(source), concurrency,
+            skip_matching)
+
+    @staticmethod
+    def _put_file_many(targets, filepath, shared, concurrency,
+                       skip_matching):
+        def push(container):
+            if skip_matching and (
+                    container._file_digest(filepath) == shared.sha256):
+                return 'skipped'
+            container.files.put(filepath, shared.reader())
+            return 'uploaded'
+
+        # The uploads still running if the caller stops early are waited
+        # for before the content is released.
+        with shared:
+            for target, status in _parallel.imap_unordered(
+                    push, targets, concurrency, join=True):
+                yield target, status
+
+    def _file_digest(self, filepath):
+        """Return the SHA-256 digest of a file, or None if unreadable."""
+        try:
+            result = self.execute(['sha256sum', filepath], record_output=True)
+        except exceptions.LXDAPIException:
+            return None
+        if result.exit_code != 0:
+            return None
+        return result.stdout.partition(' ')[0]
+
     def __init__(self, *args, **kwargs):
         super(Container, self).__init__(*args, **kwargs)
 
@@ -200,17 +568,176 @@ class Container(model.Model):
                                force=force,
                                wait=wait)
 
-    def execute(self, commands, environment={}):
+    def execute(self, commands, environment={}, encoding=None, decode=True,
+                stdout_handler=None, stderr_handler=None, max_memory=None,
+                stdin_payload=None, record_output=False, timeout=None):
         """Execute a command on the container.
 
         In pylxd 2.2, this method will be renamed `execute` and the existing
         `execute` method removed.
+
+        If `stdout_handler` or `stderr_handler` is provided, it is called
+        with each chunk of output as it arrives, rather than the output
+        being collected in memory, and the matching field of the result
+        is empty. Handlers are called from the client's websocket reactor
+        thread, so a slow handler holds off reading further output from LXD,
+        for this and any other commands running on the same client.
+
+        Output is collected as raw bytes and decoded once, using `encoding`
+        (utf-8 by default), when the command finishes. Pass `decode=False`
+        to get `bytes` back instead, e.g. for commands that write binary
+        data to stdout.
+
+        To bound memory use for commands with unpredictable output, pass
+        `max_memory`, a per-stream size in bytes. Output beyond that size is
+        spilled to a temporary file, and stdout and stderr in the result
+        are binary file objects positioned at the start. To write output
+        straight to a file of your own, pass its `write` method as a
+        handler, with `decode=False`.
+
+        `stdin_payload` is streamed to the command's standard input. It
+        may be bytes, a file object opened in binary mode or an iterable of
+        bytes; standard input is closed once it is exhausted. If the
+        command exits or stops reading before then, the rest of the payload
+        is dropped and the command's result returned as usual.
+
+        If `record_output` is True, no websockets are used. LXD records the
+        output of the command to log files, which are fetched once it has
+        finished, and then deleted. This is cheaper for short commands and
+        doesn't need ws4py, but input and output can't be streamed, so
+        the handler, `max_memory` and `stdin_payload` arguments are
+        ignored.
+
+        If the command hasn't finished within `timeout` seconds, it is
+        killed with SIGKILL through the exec control websocket, its
+        websockets are closed and the result is returned with `timed_out`
+        set. The output is whatever had arrived by then, and `exit_code`
+        is None unless LXD already had one. A timeout can't be used with
+        `record_output`.
         """
+        if isinstance(commands, six.string_types):
+            raise TypeError("First argument must be a list.")
+        if record_output and timeout is not None:
+            raise ValueError('timeout is not supported with record_output.')
+        if record_output:
+            return self._execute_recorded(
+                commands, environment, encoding, decode)
         if not _ws4py_installed:
             raise ValueError(
                 'This feature requires the optional ws4py library.')
-        if isinstance(commands, six.string_types):
-            raise TypeError("First argument must be a list.")
+        operation_id, resources = self._start_exec(commands, environment)
+        reactor = self.client.reactor
+
+        stdin = _StdinWebsocket(self.client.websocket_url)
+        stdin.resource = resources['0']
+        stdin.connect()
+        # Nothing is read from stdin, but the reactor completes its closing
+        # handshake, and so releases its socket.
+        reactor.add(stdin)
+        stdout = _CommandWebsocketClient(
+            reactor, self.client.websocket_url, encoding=encoding,
+            decode=decode, handler=stdout_handler, max_memory=max_memory)
+        stdout.resource = resources['1']
+        stdout.connect()
+        stderr = _CommandWebsocketClient(
+            reactor, self.client.websocket_url, encoding=encoding,
+            decode=decode, handler=stderr_handler, max_memory=max_memory)
+        stderr.resource = resources['2']
+        stderr.connect()
+
+        payload_errors = []
+
+        def send_stdin():
+            chunks = _stream.iter_chunks(
+                stdin_payload if stdin_payload is not None else b'')
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    payload_errors.append(e)
+                    break
+                try:
+                    stdin.send(chunk, binary=True)
+                except Exception:
+                    # The command exited, or stopped reading, so its
+                    # result tells what happened.
+                    return
+            try:
+                stdin.close()
+            except Exception:
+                pass
+
+        # The command may stop reading its input at any point, so stdin is
+        # fed from another thread, leaving this one to wait for output.
+        sender = threading.Thread(target=send_stdin)
+        sender.daemon = True
+        sender.start()
+        if timeout is None:
+            # Block until both output streams have hit EOF, rather than
+            # polling the reactor, so short commands return as soon as
+            # they finish.
+            stdout.finished.wait()
+            stderr.finished.wait()
+        else:
+            deadline = time.time() + timeout
+            finished = (
+                stdout.finished.wait(timeout) and
+                stderr.finished.wait(max(0, deadline - time.time())))
+            if not finished:
+                self._kill_exec(resources['control'])
+                for websocket in (stdout, stderr):
+                    if not websocket.terminated:
+                        websocket.close()
+                return _ContainerExecuteResult(
+                    self._exec_return(operation_id, timeout=KILL_TIMEOUT),
+                    stdout.data, stderr.data, timed_out=True)
+
+        if payload_errors:
+            raise payload_errors[0]
+        return _ContainerExecuteResult(
+            self._exec_return(operation_id), stdout.data, stderr.data)
+
+    def _exec_return(self, operation_id, timeout=None):
+        """Wait for an exec operation, and return its exit code.
+
+        LXD closes the output websockets before it records the exit code,
+        so the operation is waited for rather than fetched. If `timeout`
+        is given and the operation is still running after that many
+        seconds, None is returned.
+        """
+        params = {}
+        if timeout is not None:
+            params['timeout'] = timeout
+        try:
+            response = self.client.api.operations[operation_id].wait.get(
+                params=params)
+        except exceptions.LXDAPIException:
+            if timeout is None:
+                raise
+            return None
+        operation = response.json()['metadata']
+        return (operation.get('metadata') or {}).get('return')
+
+    def _kill_exec(self, resource):
+        """Kill a running command through its control websocket."""
+        control = WebSocketBaseClient(self.client.websocket_url)
+        control.resource = resource
+        control.connect()
+        self.client.reactor.add(control)
+        control.send(json.dumps({
+            'command': 'signal',
+            'signal': signal.SIGKILL,
+        }))
+        control.close()
+
+    def _start_exec(self, commands, environment):
+        """Start a command that waits for its websockets.
+
+        Returns the operation id and a dict of websocket resources, keyed
+        by file descriptor as LXD does ('0', '1', '2' and 'control').
+        """
         response = self.api['exec'].post(json={
             'command': commands,
             'environment': environment,
@@ -222,27 +749,55 @@ class Container(model.Model):
         operation_id = response.json()['operation'].split('/')[-1]
         parsed = parse.urlparse(
             self.client.api.operations[operation_id].websocket._api_endpoint)
+        resources = dict(
+            (fd, '{}?secret={}'.format(parsed.path, secret))
+            for fd, secret in fds.items())
+        return operation_id, resources
 
-        manager = WebSocketManager()
-
-        stdin = _StdinWebsocket(self.client.websocket_url)
-        stdin.resource = '{}?secret={}'.format(parsed.path, fds['0'])
-        stdin.connect()
-        stdout = _CommandWebsocketClient(manager, self.client.websocket_url)
-        stdout.resource = '{}?secret={}'.format(parsed.path, fds['1'])
-        stdout.connect()
-        stderr = _CommandWebsocketClient(manager, self.client.websocket_url)
-        stderr.resource = '{}?secret={}'.format(parsed.path, fds['2'])
-        stderr.connect()
+    def session(self, shell=['sh'], environment={}, encoding=None):
+        """Open a session for running many commands in the container.
 
-        manager.start()
+        See `ExecSession` for details. The session should be closed
+        when done with, or used as a context manager.
+        """
+        if not _ws4py_installed:
+            raise ValueError(
+                'This feature requires the optional ws4py library.')
+        session = ExecSession(
+            self, shell=shell, environment=environment, encoding=encoding)
+        session.open()
+        return session
 
-        while len(manager.websockets.values()) > 0:
-            time.sleep(.1)
+    def _execute_recorded(self, commands, environment, encoding, decode):
+        response = self.api['exec'].post(json={
+            'command': commands,
+            'environment': environment,
+            'wait-for-websocket': False,
+            'interactive': False,
+            'record-output': True,
+        })
+        operation_id = response.json()['operation'].split('/')[-1]
 
-        operation = self.client.operations.get(operation_id)
+        # The wait response carries the finished operation, so there's no
+        # need for another request to fetch it.
+        response = self.client.api.operations[operation_id].wait.get()
+        operation = response.json()['metadata']
+        if operation['status'] == 'Failure':
+            raise exceptions.LXDAPIException(response)
+
+        output = []
+        for fd in ('1', '2'):
+            log = self.api.logs[operation['metadata']['output'][fd].split(
+                '/')[-1]]
+            # Streaming skips JSON validation of the response, which
+            # command output can happen to look like.
+            data = log.get(stream=True).content
+            log.delete()
+            if decode:
+                data = data.decode(encoding or 'utf-8')
+            output.append(data)
         return _ContainerExecuteResult(
-            operation.metadata['return'], stdout.data, stderr.data)
+            operation['metadata']['return'], output[0], output[1])
 
     def migrate(self, new_client, wait=False):
         """Migrate a container.
@@ -315,40 +870,207 @@ class Container(model.Model):
             return self.client.images.get(operation.metadata['fingerprint'])
 
 
+class ExecSession(object):
+    """A long-lived shell for running a sequence of commands.
+
+    Each call to `Container.execute` starts a new process and opens new
+    websockets. A session starts one shell, and runs each command through
+    it, so that running many small commands only pays that cost once.
+
+    Commands are written to the shell's stdin, followed by markers on
+    stdout and stderr that delimit each command's output and carry its
+    exit code. Commands get /dev/null as their stdin, so they can't
+    consume the commands that follow them.
+    """
+
+    def __init__(self, container, shell=['sh'], environment={},
+                 encoding=None):
+        self.container = container
+        self.shell = shell
+        self.environment = environment
+        self.encoding = encoding or 'utf-8'
+        self._stdin = None
+
+    def open(self):
+        """Start the shell."""
+        client = self.container.client
+        self.operation_id, resources = self.container._start_exec(
+            self.shell, self.environment)
+
+        self._stdin = _StdinWebsocket(client.websocket_url)
+        self._stdin.resource = resources['0']
+        self._stdin.connect()
+        client.reactor.add(self._stdin)
+        self._stdout = _SessionOutput()
+        self._stdout_websocket = _SessionWebsocketClient(
+            client.reactor, self._stdout, client.websocket_url)
+        self._stdout_websocket.resource = resources['1']
+        self._stdout_websocket.connect()
+        self._stderr = _SessionOutput()
+        self._stderr_websocket = _SessionWebsocketClient(
+            client.reactor, self._stderr, client.websocket_url)
+        self._stderr_websocket.resource = resources['2']
+        self._stderr_websocket.connect()
+
+    def execute(self, commands):
+        """Run a command in the shell, returning its result.
+
+        As with `Container.execute`, `commands` is a list, in the form of
+        `subprocess.Popen`.
+        """
+        if isinstance(commands, six.string_types):
+            raise TypeError("First argument must be a list.")
+        if self._stdin is None:
+            raise ValueError('The session is not open.')
+        marker = six.b('pylxd-{}'.format(uuid.uuid4().hex))
+        line = (
+            "{} </dev/null; printf '%s %d\\n' {marker} $?; "
+            "printf '%s\\n' {marker} >&2\n").format(
+                ' '.join(shlex_quote(command) for command in commands),
+                marker=marker.decode('ascii'))
+        self._stdin.send(line.encode(self.encoding), binary=True)
+
+        stdout = self._stdout.read_until(marker + b' ')
+        exit_code = int(self._stdout.read_until(b'\n'))
+        stderr = self._stderr.read_until(marker + b'\n')
+        return _ContainerExecuteResult(
+            exit_code, stdout.decode(self.encoding),
+            stderr.decode(self.encoding))
+
+    def close(self):
+        """Close the shell's stdin, and wait for it to exit."""
+        if self._stdin is None:
+            return
+        self._stdin.close()
+        self._stdin = None
+        self._stdout_websocket.finished.wait()
+        self._stderr_websocket.finished.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _SessionOutput(object):
+    """An output stream of an ExecSession, read up to markers."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def write(self, data):
+        with self.condition:
+            self.buffer.extend(data)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def read_until(self, marker):
+        """Return and consume the data before `marker`, and the marker.
+
+        Raises `ValueError` if the stream ends before the marker is seen.
+        """
+        start = 0
+        with self.condition:
+            while True:
+                index = self.buffer.find(marker, start)
+                if index != -1:
+                    data = bytes(self.buffer[:index])
+                    del self.buffer[:index + len(marker)]
+                    return data
+                if self.closed:
+                    raise ValueError('The session ended unexpectedly.')
+                # Only search the new data next time, allowing for a
+                # marker split across writes.
+                start = max(0, len(self.buffer) - len(marker) + 1)
+                self.condition.wait()
+
+
 class _CommandWebsocketClient(WebSocketBaseClient):  # pragma: no cover
     def __init__(self, manager, *args, **kwargs):
         self.manager = manager
+        self.handler = kwargs.pop('handler', None)
+        self.encoding = kwargs.pop('encoding', None) or 'utf-8'
+        self.decode = kwargs.pop('decode', True)
+        self.max_memory = kwargs.pop('max_memory', None)
+        self.finished = threading.Event()
+        if self.max_memory is None:
+            self.buffer = io.BytesIO()
+        else:
+            self.buffer = tempfile.SpooledTemporaryFile(
+                max_size=self.max_memory)
+        # Frames can split multi-byte characters, so chunks passed to a
+        # handler are decoded incrementally.
+        self._decoder = codecs.getincrementaldecoder(self.encoding)()
         super(_CommandWebsocketClient, self).__init__(*args, **kwargs)
 
     def handshake_ok(self):
         self.manager.add(self)
-        self.buffer = []
+
+    def closed(self, code, reason=None):
+        self._finish()
+
+    def _finish(self):
+        if self.finished.is_set():
+            return
+        if self.handler is not None and self.decode:
+            remainder = self._decoder.decode(b'', final=True)
+            if remainder:
+                self.handler(remainder)
+        self.finished.set()
 
     def received_message(self, message):
         if len(message.data) == 0:
             self.close()
             self.manager.remove(self)
-        if message.encoding:
-            self.buffer.append(message.data.decode(message.encoding))
+            self._finish()
+            return
+        if self.handler is None:
+            self.buffer.write(message.data)
+        elif self.decode:
+            self.handler(self._decoder.decode(bytes(message.data)))
         else:
-            self.buffer.append(message.data.decode('utf-8'))
+            self.handler(bytes(message.data))
 
     @property
     def data(self):
-        return ''.join(self.buffer)
+        if self.max_memory is not None:
+            self.buffer.seek(0)
+            return self.buffer
+        data = self.buffer.getvalue()
+        if self.decode:
+            return data.decode(self.encoding)
+        return data
+
+
+class _SessionWebsocketClient(_CommandWebsocketClient):  # pragma: no cover
+    """A websocket client that feeds a _SessionOutput."""
+
+    def __init__(self, manager, output, *args, **kwargs):
+        self.output = output
+        kwargs.update(decode=False, handler=output.write)
+        super(_SessionWebsocketClient, self).__init__(
+            manager, *args, **kwargs)
+
+    def _finish(self):
+        super(_SessionWebsocketClient, self)._finish()
+        self.output.close()
 
 
 class _StdinWebsocket(WebSocketBaseClient):  # pragma: no cover
     """A websocket client for handling stdin.
 
-    The nature of stdin in Container.execute means that we don't
-    ever use this connection. It is closed as soon as it completes
-    the handshake.
+    Container.execute writes any stdin payload to this connection once
+    the output streams are being read, and then closes it to signal EOF
+    to the command.
     """
 
-    def handshake_ok(self):
-        self.close()
-
 
 class Snapshot(model.Model):
     """A container snapshot."""
@@ -11,14 +11,27 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import bisect
+import collections
 import contextlib
+import hashlib
+import shutil
 import tempfile
-import uuid
+import threading
+import time
 import warnings
 
+import requests
 import six
 
-from pylxd.models import _model as model
+from pylxd import exceptions, simplestreams
+from pylxd.models import _model as model, _parallel, _stream
+
+# Images are large, so they are exported in large chunks.
+EXPORT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# The longest time to wait between attempts to upload an image.
+MAX_RETRY_DELAY = 60
 
 
 def _image_create_from_config(client, config, wait=False):
@@ -33,6 +46,34 @@ def _image_create_from_config(client, config, wait=False):
     return response.json()['operation']
 
 
+def _image_fingerprint(image_data, metadata=None):
+    """Compute the fingerprint LXD will give an uploaded image.
+
+    The fingerprint is the SHA-256 of the image, or of the metadata
+    followed by the rootfs for a split image. The sources are streamed,
+    so this never holds the image in memory.
+    """
+    sha256 = hashlib.sha256()
+    for source in (metadata, image_data):
+        if source is None:
+            continue
+        if not isinstance(source, _stream.Payload):
+            source = _stream.Payload(source)
+        for chunk in source:
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@contextlib.contextmanager
+def _closing_optional(f):
+    """Close `f` on exit, unless it is None."""
+    try:
+        yield f
+    finally:
+        if f is not None:
+            f.close()
+
+
 class Image(model.Model):
     """A LXD Image."""
     aliases = model.Attribute(readonly=True)
@@ -97,15 +138,38 @@ class Image(model.Model):
             images.append(cls(client, fingerprint=fingerprint))
         return images
 
+    @classmethod
+    def catalog(cls, client, max_age=None):
+        """Get an `ImageCatalog` of the images on the host."""
+        return ImageCatalog(client, max_age=max_age)
+
     @classmethod
     def create(
-            cls, client, image_data, metadata=None, public=False, wait=True):
+            cls, client, image_data, metadata=None, public=False, wait=True,
+            skip_existing=False, retries=0, retry_backoff=1,
+            attempt_callback=None):
         """Create an image.
 
         If metadata is provided, a multipart form data request is formed to
         push metadata and image together in a single request. The metadata must
         be a tar achive.
 
+        `image_data` and `metadata` may be bytes or seekable file objects
+        (or `_stream.Payload` objects, as `create_from_file` passes). Files
+        are streamed in chunks, with a Content-Length, so the image is
+        never held in memory as a whole.
+
+        If `skip_existing` is true, the fingerprint of the image is computed
+        locally first, and if LXD already has that image it is returned
+        without uploading anything.
+
+        If the upload fails with a connection error, it is retried up to
+        `retries` times, waiting `retry_backoff` seconds before the first
+        retry and twice as long before each one after. Before each retry,
+        the upload is skipped if LXD turns out to have the image after all.
+        If given, `attempt_callback(attempt, duration, error)` is called
+        after each attempt, with `error` None if it succeeded.
+
         `wait` parameter is now ignored, as the image fingerprint cannot be
         reliably determined consistently until after the image is indexed.
         """
@@ -115,42 +179,105 @@ class Image(model.Model):
                 'Image.create wait parameter ignored and will be removed in '
                 '2.3', DeprecationWarning)
 
+        # Payloads remember where file objects started, so they can be
+        # read again to compute the fingerprint, or to retry the upload.
+        if not isinstance(
+                image_data, (six.binary_type, _stream.Payload)):
+            image_data = _stream.Payload(image_data)
+        if metadata is not None and not isinstance(
+                metadata, _stream.Payload):
+            metadata = _stream.Payload(metadata)
+
+        fingerprint = None
+        if skip_existing:
+            fingerprint = _image_fingerprint(image_data, metadata)
+            if cls.exists(client, fingerprint):
+                return cls(client, fingerprint=fingerprint)
+
         headers = {}
         if public:
             headers['X-LXD-Public'] = '1'
 
         if metadata is not None:
-            boundary = str(uuid.uuid1())
-
-            data = b''
-            for name, contents in (
-                    ('metadata', metadata), ('rootfs', image_data)):
-                data += b'\r\n'.join([
-                    six.b('--{}'.format(boundary)),
-                    six.b(
-                        'Content-Disposition:form-data;'
-                        'name={};filename={}'.format(name, name)),
-                    b'Content-Type: application/octet-stream',
-                    b'',
-                    contents,
-                    b'',
-                ])
-            data += six.b('--{}--\r\n\r\n'.format(boundary))
-
-            headers['Content-Type'] = "multipart/form-data;boundary={}".format(
-                boundary)
+            data = _stream.MultipartEncoder(
+                [('metadata', metadata), ('rootfs', image_data)])
+            headers['Content-Type'] = data.content_type
         else:
             data = image_data
 
-        response = client.api.images.post(data=data, headers=headers)
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.time()
+            if hasattr(data, 'rewind'):
+                data.rewind()
+            try:
+                response = client.api.images.post(data=data, headers=headers)
+            except requests.exceptions.RequestException as e:
+                if attempt_callback is not None:
+                    attempt_callback(attempt, time.time() - started, e)
+                if attempt > retries:
+                    raise
+                time.sleep(min(
+                    retry_backoff * 2 ** (attempt - 1), MAX_RETRY_DELAY))
+                if fingerprint is None:
+                    fingerprint = _image_fingerprint(image_data, metadata)
+                try:
+                    landed = cls.exists(client, fingerprint)
+                except requests.exceptions.RequestException:
+                    # Whether the image landed is unknown, so upload it
+                    # again.
+                    landed = False
+                if landed:
+                    return cls(client, fingerprint=fingerprint)
+                continue
+            if attempt_callback is not None:
+                attempt_callback(attempt, time.time() - started, None)
+            break
+
         operation = client.operations.wait_for_operation(
             response.json()['operation'])
         return cls(client, fingerprint=operation.metadata['fingerprint'])
 
+    @classmethod
+    def create_from_file(cls, client, path, metadata_path=None, **kwargs):
+        """Create an image from local files.
+
+        `path` is the path of the image, or, with `metadata_path`, of the
+        rootfs of a split image. Other keyword arguments are passed to
+        `create`.
+        """
+        metadata = None
+        if metadata_path is not None:
+            metadata = _stream.Payload.from_path(metadata_path)
+        return cls.create(
+            client, _stream.Payload.from_path(path), metadata=metadata,
+            **kwargs)
+
     @classmethod
     def create_from_simplestreams(cls, client, server, alias,
-                                  public=False, auto_update=False):
-        """Copy an image from simplestreams."""
+                                  public=False, auto_update=False,
+                                  streams=None):
+        """Copy an image from simplestreams.
+
+        If `streams`, a `pylxd.simplestreams.SimpleStreams` reading the same
+        server, is given, the alias is resolved to a fingerprint locally,
+        and if LXD already has that image, it is returned without a pull.
+        """
+        source = alias
+        if streams is not None:
+            architectures = client.host_info['environment'].get(
+                'architectures') or []
+            architecture = None
+            if architectures:
+                architecture = simplestreams.ARCHITECTURES.get(
+                    architectures[0], architectures[0])
+            fingerprint = streams.resolve(alias, architecture)
+            if fingerprint is not None:
+                if cls.exists(client, fingerprint):
+                    return client.images.get(fingerprint)
+                source = fingerprint
+
         config = {
             'public': public,
             'auto_update': auto_update,
@@ -160,7 +287,7 @@ class Image(model.Model):
                 'mode': 'pull',
                 'server': server,
                 'protocol': 'simplestreams',
-                'fingerprint': alias
+                'fingerprint': source
             }
         }
 
@@ -187,19 +314,220 @@ class Image(model.Model):
 
         return client.images.get(op.metadata['fingerprint'])
 
-    def export(self):
+    def export(self, target=None, rootfs_target=None,
+               chunk_size=EXPORT_CHUNK_SIZE, verify=False, connections=1):
         """Export the image.
 
         Because the image itself may be quite large, we stream the download
-        in 1kb chunks, and write it to a temporary file on disk. Once that
-        file is closed, it is deleted from the disk.
+        in chunks of `chunk_size` bytes. By default, it is written to a
+        temporary file on disk, which is returned. Once that file is closed,
+        it is deleted from the disk.
+
+        If `target`, a path or a file object opened in binary mode, is
+        given, the image is written there instead. A split image is sent by
+        LXD as a multipart body; it is parsed as it streams, writing the
+        metadata tarball to `target` and the rootfs to `rootfs_target`. If
+        the export fails, any files created from paths are removed.
+
+        If `verify` is true, the SHA-256 of the image is computed as it
+        streams, and `ImageFingerprintMismatch` is raised if it doesn't
+        match the image's fingerprint.
+
+        If `connections` is more than one, `target` is a path, and LXD is
+        reached over the network and supports ranged requests for the
+        image, the image is downloaded in that many ranges at once, each
+        written straight to its place in the file. With `verify`, the file
+        is then read back to check it. Otherwise, a single stream is used.
+
+        If the client has an image cache, the image is exported into the
+        cache (and always verified) if it isn't there already, and copied
+        to the target from local disk.
         """
-        on_disk = tempfile.TemporaryFile()
-        with contextlib.closing(self.api.export.get(stream=True)) as response:
-            for chunk in response.iter_content(chunk_size=1024):
-                on_disk.write(chunk)
-        on_disk.seek(0)
-        return on_disk
+        if self.client.image_cache is not None:
+            return self._export_from_cache(
+                target, rootfs_target, chunk_size, connections)
+        if target is None:
+            on_disk = tempfile.TemporaryFile()
+            try:
+                self._export(
+                    on_disk, None, chunk_size, verify, split=False)
+            except BaseException:
+                on_disk.close()
+                raise
+            on_disk.seek(0)
+            return on_disk
+        self._export(target, rootfs_target, chunk_size, verify, connections)
+
+    def _cached_files(self, chunk_size, connections):
+        """Open the files of the image in the client's image cache.
+
+        The image is exported into the cache first, if it isn't there.
+        Returns a `(file, rootfs_file)` pair, as `ImageCache.open` does.
+        """
+        cache = self.client.image_cache
+        files = cache.open(self.fingerprint)
+        # Another writer may evict the image before it is opened, in which
+        # case it is exported again.
+        while files is None:
+            with cache.writing(self.fingerprint) as (path, rootfs_path):
+                self._export(
+                    path, rootfs_path, chunk_size, True, connections)
+            files = cache.open(self.fingerprint)
+        return files
+
+    def _export_from_cache(self, target, rootfs_target, chunk_size,
+                           connections):
+        f, rootfs = self._cached_files(chunk_size, connections)
+        with contextlib.closing(f), _closing_optional(rootfs):
+            if target is None:
+                on_disk = tempfile.TemporaryFile()
+                if rootfs is None:
+                    shutil.copyfileobj(f, on_disk, chunk_size)
+                else:
+                    # Without a target, a split image is returned in the
+                    # multipart form LXD exports it in.
+                    body = _stream.MultipartEncoder(
+                        [('metadata', f), ('rootfs', rootfs)], chunk_size)
+                    for chunk in body:
+                        on_disk.write(chunk)
+                on_disk.seek(0)
+                return on_disk
+
+            if rootfs is not None and rootfs_target is None:
+                raise ValueError('No target for the rootfs of a split image.')
+            with _stream.OutputFiles() as outputs:
+                for source, each in ((f, target), (rootfs, rootfs_target)):
+                    if source is not None:
+                        shutil.copyfileobj(
+                            source, outputs.open(each), chunk_size)
+
+    def _export(self, target, rootfs_target, chunk_size, verify,
+                connections=1, split=True):
+        if (connections > 1 and isinstance(target, six.string_types) and
+                not self.client.api._api_endpoint.startswith('http+unix://')):
+            size = self._export_size()
+            if size:
+                return self._export_ranges(
+                    target, size, chunk_size, verify, connections)
+
+        sha256 = hashlib.sha256()
+        response = self.api.export.get(stream=True)
+        with contextlib.closing(response), _stream.OutputFiles() as outputs:
+            def open_output(target):
+                output = outputs.open(target)
+                if verify:
+                    output = _stream.HashingWriter(output, sha256)
+                return output
+
+            chunks = response.iter_content(chunk_size=chunk_size)
+            boundary = _stream.multipart_boundary(
+                response.headers.get('Content-Type'))
+            if boundary is None:
+                output = open_output(target)
+                for chunk in chunks:
+                    output.write(chunk)
+            elif not split:
+                # The multipart body is kept whole, but the fingerprint
+                # only covers the content of its parts.
+                output = outputs.open(target)
+                parser = None
+                if verify:
+                    parser = _stream.MultipartParser(
+                        boundary,
+                        lambda name: _stream.HashingWriter(None, sha256))
+                for chunk in chunks:
+                    output.write(chunk)
+                    if parser is not None:
+                        parser.feed(chunk)
+                if parser is not None:
+                    parser.close()
+            else:
+                targets = {'metadata': target, 'rootfs': rootfs_target}
+
+                def open_part(name):
+                    if targets.get(name) is None:
+                        raise ValueError(
+                            'No target for the {} of a split image.'.format(
+                                name))
+                    return open_output(targets[name])
+                parser = _stream.MultipartParser(boundary, open_part)
+                for chunk in chunks:
+                    parser.feed(chunk)
+                parser.close()
+
+            if verify and sha256.hexdigest() != self.fingerprint:
+                raise exceptions.ImageFingerprintMismatch(
+                    self.fingerprint, sha256.hexdigest())
+
+    def _export_size(self):
+        """Return the size of the image, if LXD serves it in ranges.
+
+        Split images can't be fetched in ranges, so None is returned.
+        """
+        response = self.api.export.get(
+            headers={'Range': 'bytes=0-0'}, stream=True)
+        with contextlib.closing(response):
+            content_range = response.headers.get('Content-Range', '')
+            if response.status_code != 206 or '/' not in content_range:
+                return None
+            size = content_range.rsplit('/', 1)[1]
+            return int(size) if size.isdigit() else None
+
+    def _export_ranges(self, target, size, chunk_size, verify, connections):
+        step = -(-size // connections)
+        ranges = [
+            (start, min(start + step, size) - 1)
+            for start in six.moves.range(0, size, step)]
+        lock = threading.Lock()
+        failed = threading.Event()
+
+        with _stream.OutputFiles() as outputs:
+            output = outputs.open(target)
+            output.truncate(size)
+            fd = output.fileno()
+
+            def fetch(byte_range):
+                if failed.is_set():
+                    return
+                start, end = byte_range
+                response = self.api.export.get(
+                    headers={'Range': 'bytes={}-{}'.format(start, end)},
+                    stream=True)
+                with contextlib.closing(response):
+                    if response.status_code != 206:
+                        raise ValueError(
+                            'LXD ignored the range {}-{}.'.format(start, end))
+                    offset = start
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if failed.is_set():
+                            return
+                        _stream.pwrite(fd, chunk, offset, lock)
+                        offset += len(chunk)
+                if offset != end + 1:
+                    raise IOError(
+                        'Range {}-{} of the image was cut short.'.format(
+                            start, end))
+
+            # Every range is waited for before the file is closed, as the
+            # others are still writing to it when one fails.
+            errors = []
+            for _, error in _parallel.imap_unordered(
+                    fetch, ranges, connections):
+                if error is not None:
+                    failed.set()
+                    errors.append(error)
+            if errors:
+                raise errors[0]
+
+            if verify:
+                output.flush()
+                sha256 = hashlib.sha256()
+                with open(target, 'rb') as f:
+                    for chunk in _stream.iter_chunks(f, chunk_size):
+                        sha256.update(chunk)
+                if sha256.hexdigest() != self.fingerprint:
+                    raise exceptions.ImageFingerprintMismatch(
+                        self.fingerprint, sha256.hexdigest())
 
     def add_alias(self, name, description):
         """Add an alias to the image."""
@@ -232,17 +560,26 @@ class Image(model.Model):
 
         Destination host information is contained in the client
         connection passed in.
+
+        If the image is in the client's image cache, it is uploaded to the
+        new host from local disk, rather than pulled from this host.
         """
         self.sync()  # Make sure the object isn't stale
 
-        url = '/'.join(self.client.api._api_endpoint.split('/')[:-1])
-
         if public is None:
             public = self.public
 
         if auto_update is None:
             auto_update = self.auto_update
 
+        cache = self.client.image_cache
+        files = cache.open(self.fingerprint) if cache is not None else None
+        if files is not None:
+            return self._copy_from_cache(
+                new_client, files, public, auto_update, wait)
+
+        url = '/'.join(self.client.api._api_endpoint.split('/')[:-1])
+
         config = {
             'filename': self.filename,
             'public': public,
@@ -269,3 +606,182 @@ class Image(model.Model):
 
         if wait:
             return new_client.images.get(self.fingerprint)
+
+    def _copy_from_cache(self, new_client, files, public, auto_update, wait):
+        f, rootfs = files
+        with contextlib.closing(f), _closing_optional(rootfs):
+            if rootfs is None:
+                image = self.create(new_client, f, public=public)
+            else:
+                image = self.create(
+                    new_client, rootfs, metadata=f, public=public)
+
+        image.sync()
+        image.auto_update = auto_update
+        image.properties = self.properties
+        image.save(wait=True)
+
+        if wait:
+            return image
+
+    def distribute(self, clients, max_parallel=10, strategy='tree',
+                   public=None, auto_update=None):
+        """Copy the image to many other LXD hosts.
+
+        With the `'tree'` strategy, the image is copied in waves: the first
+        wave pulls from this host, and every host that has the image then
+        serves as a source for one host in the next wave, so the number of
+        sources doubles with each wave. The hosts that received the image
+        most recently are used first, and this host only serves a copy
+        when fewer than `max_parallel` other sources are available. Hosts
+        connected through a local unix socket can't be pulled from, so
+        they are never used as sources. With the `'star'` strategy, every
+        host pulls from this one. Either way, up to `max_parallel` copies
+        run at once.
+
+        Yields `(client, image)` pairs as each copy completes. If a copy
+        fails, the exception is yielded in place of the image.
+        """
+        if strategy not in ('tree', 'star'):
+            raise ValueError('Unknown strategy: {}'.format(strategy))
+        return self._distribute(
+            list(clients), max_parallel, strategy, public, auto_update)
+
+    def _distribute(self, clients, max_parallel, strategy, public,
+                    auto_update):
+        def copy(pair):
+            source, client = pair
+            return source.copy(
+                client, public=public, auto_update=auto_update, wait=True)
+
+        # Sources are kept newest first, with this host last, so that it
+        # only serves copies when no other host is free to.
+        sources = []
+        while clients:
+            if strategy == 'tree':
+                pairs = list(zip(sources + [self], clients[:max_parallel]))
+            else:
+                pairs = [(self, client) for client in clients]
+            clients = clients[len(pairs):]
+            received = []
+            for (_, client), image in _parallel.imap_unordered(
+                    copy, pairs, max_parallel):
+                if (not isinstance(image, Exception) and
+                        not client.api._api_endpoint.startswith(
+                            'http+unix://')):
+                    received.append(image)
+                yield client, image
+            sources = received + sources
+
+
+class ImageCatalog(object):
+    """An in-memory index of the images on a LXD host.
+
+    The catalog is built from a single `recursion=1` listing of the host's
+    images, which includes their aliases and properties, and answers
+    lookups by alias, fingerprint prefix and property without any further
+    requests.
+
+    `refresh` brings the catalog up to date with another listing, only
+    re-indexing the images that changed. If `max_age` is given, lookups
+    refresh the catalog first once it is that many seconds old.
+    """
+
+    def __init__(self, client, max_age=None):
+        self.client = client
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._images = {}
+        self._aliases = {}
+        self._properties = collections.defaultdict(set)
+        self._fingerprints = []
+        self._refreshed_at = None
+        self.refresh()
+
+    def refresh(self):
+        """Update the catalog from the host."""
+        response = self.client.api.images.get(params={'recursion': 1})
+        images = dict(
+            (metadata['fingerprint'], metadata)
+            for metadata in response.json()['metadata'])
+
+        with self._lock:
+            changed = set(self._images) - set(images)
+            for fingerprint in changed:
+                self._unindex(fingerprint)
+            for fingerprint, metadata in images.items():
+                if self._images.get(fingerprint) != metadata:
+                    changed.add(fingerprint)
+                    self._unindex(fingerprint)
+                    self._index(fingerprint, metadata)
+            if changed:
+                self._fingerprints = sorted(self._images)
+            self._refreshed_at = time.time()
+
+    def _index(self, fingerprint, metadata):
+        self._images[fingerprint] = metadata
+        for alias in metadata.get('aliases') or []:
+            self._aliases[alias['name']] = fingerprint
+        for item in (metadata.get('properties') or {}).items():
+            self._properties[item].add(fingerprint)
+
+    def _unindex(self, fingerprint):
+        metadata = self._images.pop(fingerprint, None)
+        if metadata is None:
+            return
+        for alias in metadata.get('aliases') or []:
+            if self._aliases.get(alias['name']) == fingerprint:
+                del self._aliases[alias['name']]
+        for item in (metadata.get('properties') or {}).items():
+            self._properties[item].discard(fingerprint)
+            if not self._properties[item]:
+                del self._properties[item]
+
+    def _check_age(self):
+        if (self.max_age is not None and
+                time.time() - self._refreshed_at >= self.max_age):
+            self.refresh()
+
+    def _image(self, fingerprint):
+        return Image(self.client, **self._images[fingerprint])
+
+    def get(self, fingerprint):
+        """Get an image by its fingerprint, or a unique prefix of it.
+
+        Returns None if no image matches, and raises ValueError if the
+        prefix matches more than one.
+        """
+        self._check_age()
+        with self._lock:
+            index = bisect.bisect_left(self._fingerprints, fingerprint)
+            matches = [
+                each for each in self._fingerprints[index:index + 2]
+                if each.startswith(fingerprint)]
+            if len(matches) > 1:
+                raise ValueError(
+                    'Fingerprint prefix {} is ambiguous.'.format(
+                        fingerprint))
+            return self._image(matches[0]) if matches else None
+
+    def get_by_alias(self, alias):
+        """Get an image by its alias, or None."""
+        self._check_age()
+        with self._lock:
+            fingerprint = self._aliases.get(alias)
+            return self._image(fingerprint) if fingerprint else None
+
+    def find(self, **properties):
+        """Get the images with all of the given properties."""
+        self._check_age()
+        with self._lock:
+            fingerprints = set(self._images)
+            for item in properties.items():
+                fingerprints &= self._properties.get(item, set())
+            return [self._image(each) for each in sorted(fingerprints)]
+
+    def latest(self, **properties):
+        """Get the newest image with the given properties, or None."""
+        images = self.find(**properties)
+        if not images:
+            return None
+        return max(images, key=lambda image: image.created_at)
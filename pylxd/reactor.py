@@ -0,0 +1,136 @@
+# Copyright (c) 2016 Canonical Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import errno
+import os
+import select
+import threading
+
+
+class WebsocketReactor(object):
+    """Serve many websockets from a single thread.
+
+    Each `Client` has a reactor, which every websocket the client opens
+    for exec and events is added to. Rather than a thread per websocket,
+    or per command, one thread waits on all of their sockets with epoll
+    (or select, where epoll isn't available) and dispatches incoming
+    messages to each websocket's `received_message`.
+
+    The reactor is a drop-in replacement for ws4py's `WebSocketManager`,
+    with the same `add` and `remove` methods, but adding a websocket takes
+    effect immediately, rather than on the manager's next poll. The thread
+    is started when the first websocket is added.
+
+    Message handlers run on the reactor thread, so a handler that blocks
+    holds up every other websocket on the reactor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._websockets = {}
+        self._thread = None
+        self._running = False
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        if hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+            self._epoll.register(self._wakeup_read, select.EPOLLIN)
+        else:  # pragma: no cover
+            self._epoll = None
+
+    def __len__(self):
+        return len(self._websockets)
+
+    def __contains__(self, websocket):
+        return websocket in self._websockets.values()
+
+    def add(self, websocket):
+        """Start dispatching messages for a connected websocket."""
+        fd = websocket.sock.fileno()
+        with self._lock:
+            self._websockets[fd] = websocket
+            if self._epoll is not None:
+                self._epoll.register(fd, select.EPOLLIN | select.EPOLLPRI)
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(
+                    target=self._run, name='pylxd-websocket-reactor')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup()
+
+    def remove(self, websocket):
+        """Stop dispatching messages for a websocket."""
+        with self._lock:
+            for fd, candidate in list(self._websockets.items()):
+                if candidate is websocket:
+                    self._unregister(fd)
+
+    def stop(self):
+        """Stop the reactor thread, terminating any websockets left."""
+        with self._lock:
+            self._running = False
+            thread, self._thread = self._thread, None
+            websockets = list(self._websockets.values())
+            for fd in list(self._websockets):
+                self._unregister(fd)
+        self._wakeup()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        for websocket in websockets:
+            if not websocket.terminated:
+                websocket.terminate()
+
+    def _unregister(self, fd):
+        # Must be called with the lock held.
+        del self._websockets[fd]
+        if self._epoll is not None:
+            try:
+                self._epoll.unregister(fd)
+            except (IOError, OSError, ValueError):  # pragma: no cover
+                pass
+
+    def _wakeup(self):
+        os.write(self._wakeup_write, b'x')
+
+    def _poll(self):
+        try:
+            if self._epoll is not None:
+                return [fd for fd, _ in self._epoll.poll()]
+            with self._lock:  # pragma: no cover
+                fds = [self._wakeup_read] + list(self._websockets)
+            return select.select(fds, [], [])[0]  # pragma: no cover
+        except (IOError, OSError, select.error) as e:  # pragma: no cover
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def _run(self):
+        while self._running:
+            for fd in self._poll():
+                if fd == self._wakeup_read:
+                    os.read(self._wakeup_read, 4096)
+                    continue
+                with self._lock:
+                    websocket = self._websockets.get(fd)
+                if websocket is None:
+                    continue
+                try:
+                    alive = websocket.once()
+                except Exception:
+                    alive = False
+                if not alive:
+                    with self._lock:
+                        if self._websockets.get(fd) is websocket:
+                            self._unregister(fd)
+                    if not websocket.terminated:
+                        websocket.terminate()
@@ -0,0 +1,199 @@
+# Copyright (c) 2016 Canonical Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""A client-side reader for simplestreams image servers."""
+import collections
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+
+import requests
+
+INDEX_PATH = 'streams/v1/index.json'
+
+# The simplestreams names of the architectures LXD reports.
+ARCHITECTURES = {
+    'aarch64': 'arm64',
+    'armv7l': 'armhf',
+    'i686': 'i386',
+    'ppc64le': 'ppc64el',
+    's390x': 's390x',
+    'x86_64': 'amd64',
+}
+
+# The item properties holding the fingerprint LXD gives an image, in the
+# order LXD prefers them.
+_FINGERPRINT_KEYS = (
+    'combined_squashfs_sha256', 'combined_rootxz_sha256', 'combined_sha256')
+
+# A file fetched by a transport. `content` is None if the file hasn't
+# changed since it was cached.
+StreamResponse = collections.namedtuple(
+    'StreamResponse', ['content', 'etag', 'last_modified'])
+
+
+class HTTPTransport(object):
+    """Fetch simplestreams files from an HTTP(S) server."""
+
+    def __init__(self, url, session=None):
+        self.url = url.rstrip('/')
+        self.session = session or requests.Session()
+
+    def fetch(self, path, etag=None, last_modified=None):
+        """Fetch a file, unless it matches the cached validators."""
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        response = self.session.get(
+            '{}/{}'.format(self.url, path), headers=headers)
+        if response.status_code == 304:
+            return StreamResponse(None, etag, last_modified)
+        response.raise_for_status()
+        return StreamResponse(
+            response.content, response.headers.get('ETag'),
+            response.headers.get('Last-Modified'))
+
+
+class DirectoryTransport(object):
+    """Fetch simplestreams files from a local mirror of a server."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, path, etag=None, last_modified=None):
+        """Fetch a file, unless it was modified when it was cached."""
+        filename = os.path.join(self.path, *path.split('/'))
+        modified = email.utils.formatdate(
+            os.stat(filename).st_mtime, usegmt=True)
+        if modified == last_modified:
+            return StreamResponse(None, None, last_modified)
+        with open(filename, 'rb') as f:
+            return StreamResponse(f.read(), None, modified)
+
+
+class SimpleStreams(object):
+    """Read the images published on a simplestreams server.
+
+    Files are fetched through `transport`, such as an `HTTPTransport` or a
+    `DirectoryTransport`. If `cache_dir` is given, they are kept there,
+    with their ETag and Last-Modified validators, and each later fetch
+    only asks the server whether the file has changed.
+    """
+
+    def __init__(self, transport, cache_dir=None):
+        self.transport = transport
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _cache_path(self, path):
+        return os.path.join(
+            self.cache_dir,
+            hashlib.sha256(path.encode('utf-8')).hexdigest())
+
+    def _get(self, path):
+        """Return the parsed JSON file at `path`."""
+        cached = None
+        if self.cache_dir is not None:
+            try:
+                with open(self._cache_path(path)) as f:
+                    cached = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+
+        if cached is None:
+            response = self.transport.fetch(path)
+        else:
+            response = self.transport.fetch(
+                path, etag=cached['etag'],
+                last_modified=cached['last_modified'])
+            if response.content is None:
+                return cached['content']
+
+        content = json.loads(response.content.decode('utf-8'))
+        if self.cache_dir is not None:
+            fd, temporary = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'etag': response.etag,
+                    'last_modified': response.last_modified,
+                    'content': content,
+                }, f)
+            os.rename(temporary, self._cache_path(path))
+        return content
+
+    def index(self):
+        """Return the server's index."""
+        return self._get(INDEX_PATH)
+
+    def products(self):
+        """Return the image products on the server, by name."""
+        products = {}
+        for entry in self.index()['index'].values():
+            if entry.get('datatype') != 'image-downloads':
+                continue
+            products.update(self._get(entry['path'])['products'])
+        return products
+
+    def resolve(self, alias, architecture=None):
+        """Return the fingerprint of the latest image with an alias.
+
+        `architecture` is in simplestreams form, such as `amd64`; if it
+        isn't given, the alias must only match one architecture. As with
+        LXD, the alias may also name the architecture itself, as in
+        `xenial/amd64`, which takes precedence. Returns None if no image
+        has the alias.
+        """
+        name, _, suffix = alias.rpartition('/')
+        if name and suffix in ARCHITECTURES.values():
+            alias, architecture = name, suffix
+        matches = []
+        for product in self.products().values():
+            aliases = [
+                each.strip() for each in product.get('aliases', '').split(',')]
+            if alias not in aliases:
+                continue
+            if architecture is not None and product.get('arch') != (
+                    architecture):
+                continue
+            matches.append(product)
+        if not matches:
+            return None
+        if len(matches) > 1:
+            raise ValueError(
+                'Alias {} matches more than one image.'.format(alias))
+
+        versions = matches[0].get('versions', {})
+        for version in sorted(versions, reverse=True):
+            fingerprint = _version_fingerprint(versions[version])
+            if fingerprint is not None:
+                return fingerprint
+        return None
+
+
+def _version_fingerprint(version):
+    """Return the fingerprint LXD gives the image of a product version."""
+    items = version.get('items', {})
+    for item in items.values():
+        if item.get('ftype') == 'lxd.tar.xz':
+            for key in _FINGERPRINT_KEYS:
+                if key in item:
+                    return item[key]
+    for item in items.values():
+        if item.get('ftype') == 'lxd_combined.tar.gz':
+            return item.get('sha256')
+    return None
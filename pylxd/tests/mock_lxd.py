@@ -591,6 +591,11 @@ RULES = [
     {
         'text': json.dumps({
             'type': 'sync',
+            'metadata': {
+                'id': 'operation-abc',
+                'status': 'Success',
+                'metadata': {'return': 0},
+            },
             }),
         'method': 'GET',
         'url': r'^http://pylxd.test/1.0/operations/operation-abc/wait$',
@@ -1,8 +1,20 @@
+import contextlib
+import hashlib
+import io
 import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
 
 import mock
+from six.moves.urllib import parse
 
 from pylxd import exceptions, models
+from pylxd.models import container
 from pylxd.tests import testing
 
 
@@ -180,9 +192,11 @@ class TestContainer(testing.PyLXDTestCase):
         an_container.delete(wait=True)
 
     @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
     @mock.patch('pylxd.models.container._StdinWebsocket')
     @mock.patch('pylxd.models.container._CommandWebsocketClient')
-    def test_execute(self, _CommandWebsocketClient, _StdinWebsocket):
+    def test_execute(self, _CommandWebsocketClient, _StdinWebsocket,
+                     WebsocketReactor):
         """A command is executed on a container."""
         fake_websocket = mock.Mock()
         fake_websocket.data = 'test\n'
@@ -196,6 +210,261 @@ class TestContainer(testing.PyLXDTestCase):
 
         self.assertEqual(0, result.exit_code)
         self.assertEqual('test\n', result.stdout)
+        self.assertFalse(result.timed_out)
+
+    @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
+    @mock.patch('pylxd.models.container._StdinWebsocket')
+    @mock.patch('pylxd.models.container._CommandWebsocketClient')
+    def test_execute_return_not_recorded(
+            self, _CommandWebsocketClient, _StdinWebsocket, WebsocketReactor):
+        """The exit code is waited for after the output has finished."""
+        self.add_rule({
+            'text': json.dumps({
+                'type': 'sync',
+                'metadata': {
+                    'id': 'operation-abc',
+                    'metadata': {'fds': {}},
+                },
+            }),
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/operations/operation-abc$',
+        })
+        self.add_rule({
+            'text': json.dumps({
+                'type': 'sync',
+                'metadata': {
+                    'id': 'operation-abc',
+                    'status': 'Success',
+                    'metadata': {'return': 3},
+                },
+            }),
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/operations/operation-abc/wait',
+        })
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        result = an_container.execute(['false'])
+
+        self.assertEqual(3, result.exit_code)
+
+    @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
+    @mock.patch('pylxd.models.container._StdinWebsocket')
+    @mock.patch('pylxd.models.container._CommandWebsocketClient')
+    def test_execute_with_handlers(
+            self, _CommandWebsocketClient, _StdinWebsocket, WebsocketReactor):
+        """Output handlers are passed through to the websockets."""
+        stdout_handler = mock.Mock()
+        stderr_handler = mock.Mock()
+
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        an_container.execute(
+            ['echo', 'test'], stdout_handler=stdout_handler,
+            stderr_handler=stderr_handler)
+
+        handlers = [
+            call[1]['handler']
+            for call in _CommandWebsocketClient.call_args_list]
+        self.assertEqual([stdout_handler, stderr_handler], handlers)
+
+    @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
+    @mock.patch('pylxd.models.container._StdinWebsocket')
+    @mock.patch('pylxd.models.container._CommandWebsocketClient')
+    def test_execute_with_stdin(
+            self, _CommandWebsocketClient, _StdinWebsocket, WebsocketReactor):
+        """A stdin payload is streamed over the stdin websocket."""
+        stdin = _StdinWebsocket.return_value
+        closed = threading.Event()
+        stdin.close.side_effect = lambda: closed.set()
+        # The output finishes once the command has read all of its input.
+        _CommandWebsocketClient.return_value.finished.wait.side_effect = (
+            lambda *args: closed.wait(5))
+
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        an_container.execute(
+            ['cat'], stdin_payload=iter([b'test', b'ing\n']))
+
+        self.assertEqual(
+            [mock.call(b'test', binary=True),
+             mock.call(b'ing\n', binary=True)],
+            stdin.send.call_args_list)
+        stdin.close.assert_called_once_with()
+
+    @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
+    @mock.patch('pylxd.models.container._StdinWebsocket')
+    @mock.patch('pylxd.models.container._CommandWebsocketClient')
+    def test_execute_stdin_not_read(
+            self, _CommandWebsocketClient, _StdinWebsocket, WebsocketReactor):
+        """The result is returned if the command stops reading stdin."""
+        _StdinWebsocket.return_value.send.side_effect = IOError()
+        _CommandWebsocketClient.return_value.data = ''
+
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        result = an_container.execute(
+            ['head', '-c1'], stdin_payload=b'test')
+
+        self.assertEqual(0, result.exit_code)
+
+    def test_execute_record_output(self):
+        """A command's recorded output is fetched and the logs deleted."""
+        def exec_POST(request, context):
+            self.assertTrue(request.json()['record-output'])
+            self.assertFalse(request.json()['wait-for-websocket'])
+            context.status_code = 202
+            return {'type': 'async', 'operation': 'operation-exec'}
+        deleted = []
+
+        def log_DELETE(request, context):
+            deleted.append(request.path.split('/')[-1])
+            return {'type': 'sync'}
+        logs = r'^http://pylxd.test/1.0/containers/an-container/logs/'
+        self.add_rule({
+            'json': exec_POST,
+            'method': 'POST',
+            'url': r'^http://pylxd.test/1.0/containers/an-container/exec$',  # NOQA
+        })
+        self.add_rule({
+            'json': {
+                'type': 'sync',
+                'metadata': {
+                    'id': 'operation-exec',
+                    'status': 'Success',
+                    'metadata': {
+                        'return': 0,
+                        'output': {
+                            '1': '/1.0/containers/an-container/logs/exec_abc.stdout',  # NOQA
+                            '2': '/1.0/containers/an-container/logs/exec_abc.stderr',  # NOQA
+                        },
+                    },
+                }},
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/operations/operation-exec/wait$',
+        })
+        self.add_rule({
+            'text': '{"type": "not-lxd"}',
+            'method': 'GET',
+            'url': logs + r'exec_abc.stdout$',
+        })
+        self.add_rule({
+            'text': '',
+            'method': 'GET',
+            'url': logs + r'exec_abc.stderr$',
+        })
+        self.add_rule({
+            'json': log_DELETE,
+            'method': 'DELETE',
+            'url': logs + r'exec_abc.std(out|err)$',
+        })
+
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        result = an_container.execute(
+            ['echo', '{"type": "not-lxd"}'], record_output=True)
+
+        self.assertEqual(
+            (0, '{"type": "not-lxd"}', ''), tuple(result))
+        self.assertEqual(['exec_abc.stdout', 'exec_abc.stderr'], deleted)
+
+    @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
+    @mock.patch('pylxd.models.container._StdinWebsocket')
+    @mock.patch('pylxd.models.container._CommandWebsocketClient')
+    def test_execute_many(
+            self, _CommandWebsocketClient, _StdinWebsocket, WebsocketReactor):
+        """A command is executed on many containers, sharing a reactor."""
+        fake_websocket = mock.Mock()
+        fake_websocket.data = 'test\n'
+        _CommandWebsocketClient.return_value = fake_websocket
+        an_container = models.Container(self.client, name='an-container')
+
+        results = list(self.client.containers.execute_many(
+            [an_container, 'an-container'], ['echo', 'test'],
+            concurrency=2))
+
+        self.assertEqual(2, len(results))
+        self.assertIn(an_container, [c for c, _ in results])
+        for each, result in results:
+            self.assertEqual('an-container', each.name)
+            self.assertEqual((0, 'test\n', 'test\n'), tuple(result))
+        WebsocketReactor.assert_called_once_with()
+        reactors = set(
+            call[0][0] for call in _CommandWebsocketClient.call_args_list)
+        self.assertEqual(set([WebsocketReactor.return_value]), reactors)
+
+    def test_execute_many_record_output_no_ws4py(self):
+        """Recorded output doesn't need ws4py."""
+        old_installed = container._ws4py_installed
+        container._ws4py_installed = False
+
+        def cleanup():
+            container._ws4py_installed = old_installed
+        self.addCleanup(cleanup)
+
+        with mock.patch.object(models.Container, 'execute') as execute:
+            execute.return_value = container._ContainerExecuteResult(
+                0, 'test\n', '')
+            results = list(self.client.containers.execute_many(
+                ['an-container'], ['echo', 'test'], record_output=True))
+
+        self.assertEqual(0, results[0][1].exit_code)
+        execute.assert_called_once_with(['echo', 'test'], record_output=True)
+
+    @testing.requires_ws4py
+    def test_execute_many_string_command(self):
+        """A string command is rejected when execute_many is called."""
+        self.assertRaises(
+            TypeError, self.client.containers.execute_many,
+            ['an-container'], 'echo test')
+
+    @testing.requires_ws4py
+    @mock.patch('pylxd.client.WebsocketReactor')
+    @mock.patch('pylxd.models.container.WebSocketBaseClient')
+    @mock.patch('pylxd.models.container._StdinWebsocket')
+    @mock.patch('pylxd.models.container._CommandWebsocketClient')
+    def test_execute_timeout(
+            self, _CommandWebsocketClient, _StdinWebsocket,
+            WebSocketBaseClient, WebsocketReactor):
+        """A command is killed when it runs past its timeout."""
+        fake_websocket = mock.Mock(terminated=False)
+        fake_websocket.data = 'partial\n'
+        fake_websocket.finished.wait.return_value = False
+        _CommandWebsocketClient.return_value = fake_websocket
+        control = WebSocketBaseClient.return_value
+
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        result = an_container.execute(['sleep', 'infinity'], timeout=0.01)
+
+        self.assertTrue(result.timed_out)
+        self.assertEqual('partial\n', result.stdout)
+        self.assertEqual('/1.0/operations/operation-abc/websocket?secret=jkl',
+                         control.resource)
+        self.assertEqual(
+            {'command': 'signal', 'signal': 9},
+            json.loads(control.send.call_args[0][0]))
+        fake_websocket.close.assert_called_with()
+
+    @testing.requires_ws4py
+    def test_execute_timeout_record_output(self):
+        """A timeout can't be used with record_output."""
+        an_container = models.Container(
+            self.client, name='an-container')
+
+        self.assertRaises(
+            ValueError, an_container.execute, ['true'],
+            record_output=True, timeout=1)
 
     def test_execute_no_ws4py(self):
         """If ws4py is not installed, ValueError is raised."""
@@ -276,6 +545,147 @@ class TestContainer(testing.PyLXDTestCase):
             image.fingerprint)
 
 
+@testing.requires_ws4py
+class TestCommandWebsocketClient(unittest.TestCase):
+    """Tests for pylxd.models.container._CommandWebsocketClient."""
+
+    def setUp(self):
+        from ws4py import messaging
+        from pylxd.models import container
+        self.messaging = messaging
+        self.manager = mock.Mock()
+        self.websocket = container._CommandWebsocketClient(
+            self.manager, 'ws://pylxd.test')
+        self.addCleanup(self.websocket.sock.close)
+
+    def test_finished_on_empty_message(self):
+        """An empty message marks the stream as finished."""
+        self.websocket.close = mock.Mock()
+
+        self.websocket.received_message(
+            self.messaging.TextMessage(b'test\n'))
+        self.assertFalse(self.websocket.finished.is_set())
+
+        self.websocket.received_message(self.messaging.BinaryMessage(b''))
+
+        self.assertTrue(self.websocket.finished.is_set())
+        self.manager.remove.assert_called_once_with(self.websocket)
+        self.assertEqual('test\n', self.websocket.data)
+
+    def test_handler(self):
+        """Output is passed to the handler rather than buffered."""
+        handler = mock.Mock()
+        self.websocket.handler = handler
+
+        self.websocket.received_message(
+            self.messaging.TextMessage(b'test\n'))
+
+        handler.assert_called_once_with('test\n')
+        self.assertEqual('', self.websocket.data)
+
+    def test_handler_split_character(self):
+        """Characters split across frames are decoded whole."""
+        handler = mock.Mock()
+        self.websocket.handler = handler
+        data = u'\u2603'.encode('utf-8')
+
+        self.websocket.received_message(
+            self.messaging.BinaryMessage(data[:1]))
+        self.websocket.received_message(
+            self.messaging.BinaryMessage(data[1:]))
+
+        self.assertEqual(
+            u'\u2603', u''.join(c[0][0] for c in handler.call_args_list))
+
+    def test_no_decode(self):
+        """Binary output is returned untouched when not decoding."""
+        self.websocket.decode = False
+
+        self.websocket.received_message(
+            self.messaging.BinaryMessage(b'\xff\x00'))
+        self.websocket.received_message(
+            self.messaging.BinaryMessage(b'\xfe'))
+
+        self.assertEqual(b'\xff\x00\xfe', self.websocket.data)
+
+    def test_max_memory(self):
+        """Output past max_memory is spilled to disk."""
+        from pylxd.models import container
+        websocket = container._CommandWebsocketClient(
+            self.manager, 'ws://pylxd.test', max_memory=4)
+        self.addCleanup(websocket.sock.close)
+
+        websocket.received_message(
+            self.messaging.BinaryMessage(b'spilled output'))
+
+        data = websocket.data
+        self.assertTrue(data._rolled)
+        self.assertEqual(b'spilled output', data.read())
+
+    def test_finished_on_close(self):
+        """Closing the websocket marks the stream as finished."""
+        self.websocket.closed(1000)
+
+        self.assertTrue(self.websocket.finished.is_set())
+
+
+class TestExecSession(testing.PyLXDTestCase):
+    """Tests for pylxd.models.container.ExecSession."""
+
+    def setUp(self):
+        super(TestExecSession, self).setUp()
+        for name in ('pylxd.client.WebsocketReactor',
+                     'pylxd.models.container._StdinWebsocket',
+                     'pylxd.models.container._SessionWebsocketClient'):
+            patcher = mock.patch(name)
+            setattr(self, name.split('.')[-1], patcher.start())
+            self.addCleanup(patcher.stop)
+        self.outputs = []
+
+        def websocket(manager, output, url):
+            self.outputs.append(output)
+            return mock.Mock()
+        self._SessionWebsocketClient.side_effect = websocket
+
+        def send(line, binary):
+            # Play the part of the shell.
+            marker = re.search(b'(pylxd-[0-9a-f]+)', line).group(1)
+            self.outputs[0].write(b'hello')
+            self.outputs[0].write(b'\n' + marker[:3])
+            self.outputs[0].write(marker[3:] + b' 3\n')
+            self.outputs[1].write(b'oops\n' + marker + b'\n')
+        self._StdinWebsocket.return_value.send.side_effect = send
+
+        self.container = models.Container(self.client, name='an-container')
+
+    @testing.requires_ws4py
+    def test_execute(self):
+        """Commands are run through the shell and their output framed."""
+        with self.container.session() as session:
+            result = session.execute(['echo', 'hello world'])
+
+        self.assertEqual((3, 'hello\n', 'oops\n'), tuple(result))
+        line = self._StdinWebsocket.return_value.send.call_args[0][0]
+        self.assertTrue(line.startswith(b"echo 'hello world' </dev/null;"))
+        self._StdinWebsocket.return_value.close.assert_called_once_with()
+
+    @testing.requires_ws4py
+    def test_execute_closed(self):
+        """Running a command in a closed session raises ValueError."""
+        session = self.container.session()
+        session.close()
+
+        self.assertRaises(ValueError, session.execute, ['true'])
+
+    def test_read_until_ended(self):
+        """ValueError is raised if the shell exits unexpectedly."""
+        output = container._SessionOutput()
+        output.write(b'partial')
+        output.close()
+
+        self.assertRaises(ValueError, output.read_until, b'marker')
+
+
 class TestContainerState(testing.PyLXDTestCase):
     """Tests for pylxd.models.ContainerState."""
 
@@ -439,12 +849,360 @@ class TestFiles(testing.PyLXDTestCase):
 
         # TODO: Add an assertion here
 
+    def _capture_put(self):
+        requests = []
+
+        def capture(request, context):
+            requests.append(request)
+            return ''
+        self.add_rule({
+            'text': capture,
+            'method': 'POST',
+            'url': r'^http://pylxd.test/1.0/containers/an-container/files\?path=%2Ftmp%2Fputted$',  # NOQA
+        })
+        return requests
+
+    def test_put_file_object(self):
+        """A file object is streamed with its length."""
+        requests = self._capture_put()
+
+        self.container.files.put('/tmp/putted', io.BytesIO(b'file data'))
+
+        self.assertEqual('9', requests[0].headers['Content-Length'])
+
+    def test_put_iterable(self):
+        """An iterable of bytes is sent with chunked encoding."""
+        requests = self._capture_put()
+
+        self.container.files.put('/tmp/putted', iter([b'file', b' data']))
+
+        self.assertEqual('chunked', requests[0].headers['Transfer-Encoding'])
+
+    def test_upload(self):
+        """A local file is streamed to the container."""
+        requests = self._capture_put()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'file data')
+            f.flush()
+
+            self.container.files.upload('/tmp/putted', f.name)
+
+        self.assertEqual('9', requests[0].headers['Content-Length'])
+
     def test_get(self):
         """A file is retrieved from the container."""
         data = self.container.files.get('/tmp/getted')
 
         self.assertEqual(b'This is a getted file', data)
 
+    def test_get_stream(self):
+        """A file is retrieved in chunks."""
+        chunks = self.container.files.get_stream('/tmp/getted', chunk_size=8)
+
+        self.assertEqual(
+            [b'This is ', b'a getted', b' file'], list(chunks))
+
+    def test_download(self):
+        """A file is streamed to a local path."""
+        with tempfile.NamedTemporaryFile() as f:
+            self.container.files.download('/tmp/getted', f.name)
+
+            self.assertEqual(b'This is a getted file', f.read())
+
+    def test_download_file_object(self):
+        """A file is streamed to a file object."""
+        dest = io.BytesIO()
+
+        self.container.files.download('/tmp/getted', dest)
+
+        self.assertEqual(b'This is a getted file', dest.getvalue())
+
+    def test_download_failure(self):
+        """A partial download is removed."""
+        dest = os.path.join(tempfile.mkdtemp(), 'getted')
+        self.addCleanup(os.rmdir, os.path.dirname(dest))
+
+        with mock.patch('pylxd.models._stream.iter_response') as iterator:
+            def fail(response, chunk_size):
+                yield b'partial'
+                raise IOError()
+            iterator.side_effect = fail
+            self.assertRaises(
+                IOError, self.container.files.download, '/tmp/getted', dest)
+
+        self.assertFalse(os.path.exists(dest))
+
+    def _make_tree(self):
+        local_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, local_dir)
+        os.mkdir(os.path.join(local_dir, 'sub'))
+        with open(os.path.join(local_dir, 'a.txt'), 'wb') as f:
+            f.write(b'a')
+        with open(os.path.join(local_dir, 'sub', 'b.txt'), 'wb') as f:
+            f.write(b'b')
+        return local_dir
+
+    def _tar(self, files):
+        data = io.BytesIO()
+        with contextlib.closing(tarfile.open(fileobj=data, mode='w')) as tar:
+            for name, content in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        return data.getvalue()
+
+    def _files_rule(self, method, callback):
+        self.add_rule({
+            'text': callback,
+            'method': method,
+            'url': r'^http://pylxd.test/1.0/containers/an-container/files\?path=.*$',  # NOQA
+        })
+
+    @testing.requires_ws4py
+    @mock.patch.object(models.Container, 'execute')
+    def test_push_tree(self, execute):
+        """A tree is pushed as a tar stream."""
+        local_dir = self._make_tree()
+        pushed = []
+
+        def fake_execute(commands, **kwargs):
+            if kwargs.get('record_output'):
+                return container._ContainerExecuteResult(0, '/bin/tar', '')
+            pushed.append(kwargs['stdin_payload'].read())
+            return container._ContainerExecuteResult(0, '', '')
+        execute.side_effect = fake_execute
+
+        self.container.files.push_tree(local_dir, '/srv/app')
+
+        self.assertEqual('/srv/app', execute.call_args[0][0][-1])
+        tar = tarfile.open(fileobj=io.BytesIO(pushed[0]))
+        self.assertEqual(b'b', tar.extractfile('sub/b.txt').read())
+        members = tar.getmembers()
+        self.assertNotIn('.', [member.name for member in members])
+        self.assertEqual(
+            set([(0, 0, 'root')]),
+            set((member.uid, member.gid, member.uname)
+                for member in members))
+
+    @testing.requires_ws4py
+    @mock.patch.object(models.Container, 'execute')
+    def test_push_tree_failure(self, execute):
+        """ContainerCommandFailed is raised if tar fails."""
+        local_dir = self._make_tree()
+
+        def fake_execute(commands, **kwargs):
+            if kwargs.get('record_output'):
+                return container._ContainerExecuteResult(0, '/bin/tar', '')
+            return container._ContainerExecuteResult(2, '', 'tar: oops')
+        execute.side_effect = fake_execute
+
+        self.assertRaises(
+            exceptions.ContainerCommandFailed,
+            self.container.files.push_tree, local_dir, '/srv/app')
+
+    @mock.patch.object(models.Container, 'execute')
+    def test_push_tree_without_tar(self, execute):
+        """Without tar, directories are created and files uploaded."""
+        execute.return_value = container._ContainerExecuteResult(1, '', '')
+        local_dir = self._make_tree()
+        requests = []
+
+        def capture(request, context):
+            requests.append((
+                parse.parse_qs(parse.urlparse(request.url).query)['path'][0],
+                request.headers.get('X-LXD-type')))
+            return ''
+        self._files_rule('POST', capture)
+
+        self.container.files.push_tree(local_dir, '/srv/app')
+
+        self.assertEqual(
+            [('/srv/app', 'directory'), ('/srv/app/sub', 'directory')],
+            [r for r in requests if r[1]])
+        self.assertEqual(
+            ['/srv/app/a.txt', '/srv/app/sub/b.txt'],
+            sorted(r[0] for r in requests if not r[1]))
+
+    @testing.requires_ws4py
+    @mock.patch.object(models.Container, 'execute')
+    def test_pull_tree(self, execute):
+        """A tree is pulled as a tar stream."""
+        local_dir = os.path.join(self._make_tree(), 'pulled')
+        data = self._tar([('./x/y.txt', b'y'), ('../evil.txt', b'evil')])
+
+        def fake_execute(commands, **kwargs):
+            if kwargs.get('record_output'):
+                return container._ContainerExecuteResult(0, '/bin/tar', '')
+            for offset in range(0, len(data), 1000):
+                kwargs['stdout_handler'](data[offset:offset + 1000])
+            return container._ContainerExecuteResult(0, b'', b'')
+        execute.side_effect = fake_execute
+
+        self.container.files.pull_tree('/srv/app', local_dir)
+
+        with open(os.path.join(local_dir, 'x', 'y.txt'), 'rb') as f:
+            self.assertEqual(b'y', f.read())
+        self.assertFalse(os.path.exists(
+            os.path.join(os.path.dirname(local_dir), 'evil.txt')))
+
+    @mock.patch.object(models.Container, 'execute')
+    def test_pull_tree_without_tar(self, execute):
+        """Without tar, the tree is walked through the files API."""
+        execute.return_value = container._ContainerExecuteResult(1, '', '')
+        local_dir = os.path.join(self._make_tree(), 'pulled')
+        tree = {
+            '/srv/app': ['x', '..'],
+            '/srv/app/x': ['y.txt'],
+            '/srv/app/x/y.txt': b'y',
+        }
+
+        def files_GET(request, context):
+            path = parse.parse_qs(parse.urlparse(request.url).query)['path']
+            entry = tree[path[0]]
+            if isinstance(entry, list):
+                context.headers['X-LXD-type'] = 'directory'
+                return json.dumps({'type': 'sync', 'metadata': entry})
+            context.headers['X-LXD-type'] = 'file'
+            return entry.decode('utf-8')
+        self._files_rule('GET', files_GET)
+
+        self.container.files.pull_tree('/srv/app', local_dir)
+
+        with open(os.path.join(local_dir, 'x', 'y.txt'), 'rb') as f:
+            self.assertEqual(b'y', f.read())
+
+    def test_put_file_many(self):
+        """A file is pushed to every target."""
+        bodies = []
+
+        def capture(request, context):
+            bodies.append(request.body.read())
+            return ''
+        self._files_rule('POST', capture)
+
+        results = list(self.client.containers.put_file_many(
+            ['an-container', self.container], '/etc/app.conf',
+            io.BytesIO(b'config')))
+
+        self.assertEqual(
+            ['uploaded', 'uploaded'], [status for _, status in results])
+        self.assertEqual([b'config', b'config'], bodies)
+
+    @mock.patch.object(models.Container, 'execute')
+    def test_put_file_many_skip_matching(self, execute):
+        """Targets that already have the content are skipped."""
+        digest = hashlib.sha256(b'config').hexdigest()
+        execute.side_effect = [
+            container._ContainerExecuteResult(
+                0, digest + '  /etc/app.conf\n', ''),
+            container._ContainerExecuteResult(1, '', 'No such file'),
+        ]
+        self._files_rule('POST', lambda request, context: '')
+
+        results = list(self.client.containers.put_file_many(
+            ['an-container', 'an-container'], '/etc/app.conf', b'config',
+            concurrency=1, skip_matching=True))
+
+        self.assertEqual(
+            ['skipped', 'uploaded'], [status for _, status in results])
+
+    def test_put_file_many_failure(self):
+        """A failed upload is reported in place of the status."""
+        def fail(request, context):
+            context.status_code = 500
+            return json.dumps({
+                'type': 'error', 'error': 'Not found', 'error_code': 500})
+        self._files_rule('POST', fail)
+
+        results = list(self.client.containers.put_file_many(
+            ['an-container'], '/etc/app.conf', b'config'))
+
+        self.assertIsInstance(results[0][1], exceptions.LXDAPIException)
+
+    def test_put_file_many_invalid_source(self):
+        """An invalid source is rejected when put_file_many is called."""
+        self.assertRaises(
+            TypeError, self.client.containers.put_file_many,
+            ['an-container'], '/etc/app.conf', object())
+
+    def _digests(self, *lines):
+        return container._ContainerExecuteResult(
+            0, '\n'.join(lines) + '\n', '')
+
+    @testing.requires_ws4py
+    @mock.patch.object(models.Container, 'execute')
+    def test_sync_tree(self, execute):
+        """Only files whose digests differ are pushed."""
+        local_dir = self._make_tree()
+        digest = hashlib.sha256(b'a').hexdigest()
+        pushed = []
+
+        def fake_execute(commands, **kwargs):
+            if kwargs.get('record_output'):
+                return self._digests('tar', digest + '  ./a.txt')
+            pushed.append(kwargs['stdin_payload'].read())
+            return container._ContainerExecuteResult(0, '', '')
+        execute.side_effect = fake_execute
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_file = os.path.join(cache_dir, 'cache.json')
+
+        synced = self.container.files.sync_tree(
+            local_dir, '/srv/app', cache_file=cache_file)
+
+        self.assertEqual(['sub/b.txt'], synced)
+        tar = tarfile.open(fileobj=io.BytesIO(pushed[0]))
+        self.assertEqual(['sub/b.txt'], tar.getnames())
+        self.assertTrue(os.path.exists(cache_file))
+
+    @mock.patch.object(models.Container, 'execute')
+    def test_sync_tree_unchanged(self, execute):
+        """Nothing is pushed if the digests match."""
+        local_dir = self._make_tree()
+        execute.return_value = self._digests(
+            'tar',
+            hashlib.sha256(b'a').hexdigest() + '  ./a.txt',
+            hashlib.sha256(b'b').hexdigest() + '  ./sub/b.txt')
+
+        synced = self.container.files.sync_tree(local_dir, '/srv/app')
+
+        self.assertEqual([], synced)
+        self.assertEqual(1, execute.call_count)
+
+    @mock.patch.object(models.Container, 'execute')
+    def test_sync_tree_without_tar(self, execute):
+        """Without tar, changed files are uploaded."""
+        local_dir = self._make_tree()
+        execute.return_value = self._digests(
+            hashlib.sha256(b'a').hexdigest() + '  ./a.txt')
+        requests = []
+
+        def capture(request, context):
+            requests.append((
+                parse.parse_qs(parse.urlparse(request.url).query)['path'][0],
+                request.headers.get('X-LXD-type')))
+            return ''
+        self._files_rule('POST', capture)
+
+        synced = self.container.files.sync_tree(local_dir, '/srv/app')
+
+        self.assertEqual(['sub/b.txt'], synced)
+        self.assertEqual(
+            [('/srv/app', 'directory'), ('/srv/app/sub', 'directory'),
+             ('/srv/app/sub/b.txt', None)],
+            requests)
+
+    @mock.patch.object(models.Container, 'execute')
+    def test_sync_tree_failure(self, execute):
+        """ContainerCommandFailed is raised if the digests can't be read."""
+        execute.return_value = container._ContainerExecuteResult(
+            1, '', 'sha256sum: not found')
+
+        self.assertRaises(
+            exceptions.ContainerCommandFailed,
+            self.container.files.sync_tree, self._make_tree(), '/srv/app')
+
     def test_get_not_found(self):
         """LXDAPIException is raised on bogus filenames."""
         def not_found(request, context):
@@ -1,8 +1,17 @@
 import hashlib
+import io
 import json
+import os
+import shutil
+import tempfile
+import time
 
-from pylxd import exceptions, models
-from pylxd.tests import testing
+import mock
+import requests
+
+from pylxd import exceptions, image_cache, models, simplestreams
+from pylxd.models import _stream, image
+from pylxd.tests import test_simplestreams, testing
 
 
 class TestImage(testing.PyLXDTestCase):
@@ -115,6 +124,182 @@ class TestImage(testing.PyLXDTestCase):
         self.assertIsInstance(a_image, models.Image)
         self.assertEqual(fingerprint, a_image.fingerprint)
 
+    def _capture_create(self):
+        requests = []
+
+        def capture(request, context):
+            body = request.body
+            if not isinstance(body, bytes):
+                body = b''.join(body)
+            requests.append((request, body))
+            context.status_code = 202
+            return json.dumps({
+                'type': 'async',
+                'operation': 'images-create-operation'})
+        self.add_rule({
+            'text': capture,
+            'method': 'POST',
+            'url': r'^http://pylxd.test/1.0/images$',
+        })
+        return requests
+
+    def test_create_from_file(self):
+        """An image is streamed from a file object."""
+        requests = self._capture_create()
+
+        models.Image.create(self.client, io.BytesIO(b'rootfs'))
+
+        request, body = requests[0]
+        self.assertEqual(b'rootfs', body)
+        self.assertEqual('6', request.headers['Content-Length'])
+
+    def test_create_with_metadata_streamed(self):
+        """A split image is streamed from paths with its length."""
+        requests = self._capture_create()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = []
+        for name in ('rootfs', 'metadata'):
+            paths.append(os.path.join(directory, name))
+            with open(paths[-1], 'wb') as f:
+                f.write(name.encode('utf-8'))
+
+        models.Image.create_from_file(
+            self.client, paths[0], metadata_path=paths[1])
+
+        request, body = requests[0]
+        self.assertIn(b'\r\n\r\nrootfs\r\n', body)
+        self.assertIn(b'\r\n\r\nmetadata\r\n', body)
+        self.assertEqual(
+            str(len(body)), request.headers['Content-Length'])
+        self.assertTrue(request.headers['Content-Type'].startswith(
+            'multipart/form-data;boundary='))
+
+    def test_create_skip_existing(self):
+        """An image LXD already has isn't uploaded again."""
+        requests = self._capture_create()
+        fingerprint = hashlib.sha256(b'').hexdigest()
+
+        a_image = models.Image.create(
+            self.client, b'', metadata=io.BytesIO(b''), skip_existing=True)
+
+        self.assertEqual(fingerprint, a_image.fingerprint)
+        self.assertEqual([], requests)
+
+    def test_create_skip_existing_missing(self):
+        """A new image is uploaded."""
+        def not_found(request, context):
+            context.status_code = 404
+            return json.dumps({
+                'type': 'error',
+                'error': 'Not found',
+                'error_code': 404})
+        self.add_rule({
+            'text': not_found,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/{}$'.format(
+                hashlib.sha256(b'rootfs').hexdigest()),
+        })
+        requests = self._capture_create()
+
+        models.Image.create(self.client, b'rootfs', skip_existing=True)
+
+        self.assertEqual(b'rootfs', requests[0][1])
+
+    def _flaky_create(self, failures):
+        bodies = []
+
+        def create(request, context):
+            body = request.body or b''
+            if not isinstance(body, bytes):
+                body = b''.join(body)
+            bodies.append(body)
+            if len(bodies) <= failures:
+                raise requests.exceptions.ConnectionError()
+            context.status_code = 202
+            return json.dumps({
+                'type': 'async',
+                'operation': 'images-create-operation'})
+        self.add_rule({
+            'text': create,
+            'method': 'POST',
+            'url': r'^http://pylxd.test/1.0/images$',
+        })
+        return bodies
+
+    def _image_not_found(self, fingerprint):
+        def not_found(request, context):
+            context.status_code = 404
+            return json.dumps({
+                'type': 'error',
+                'error': 'Not found',
+                'error_code': 404})
+        self.add_rule({
+            'text': not_found,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/{}$'.format(fingerprint),
+        })
+
+    @mock.patch('pylxd.models.image.time.sleep')
+    def test_create_retry(self, sleep):
+        """A failed upload is retried from the start, with backoff."""
+        bodies = self._flaky_create(failures=2)
+        self._image_not_found(hashlib.sha256(b'rootfs').hexdigest())
+        source = io.BytesIO(b'rootfs')
+        attempts = []
+
+        models.Image.create(
+            self.client, source, retries=2, retry_backoff=3,
+            attempt_callback=lambda *args: attempts.append(args))
+
+        self.assertEqual([b'rootfs'] * 3, bodies)
+        self.assertEqual(
+            [mock.call(3), mock.call(6)], sleep.call_args_list)
+        self.assertEqual([1, 2, 3], [attempt[0] for attempt in attempts])
+        self.assertIsInstance(
+            attempts[0][2], requests.exceptions.ConnectionError)
+        self.assertIsNone(attempts[2][2])
+
+    @mock.patch('pylxd.models.image.time.sleep')
+    def test_create_retry_exhausted(self, sleep):
+        """The error is raised once the retries are used up."""
+        self._flaky_create(failures=2)
+        self._image_not_found(hashlib.sha256(b'rootfs').hexdigest())
+
+        self.assertRaises(
+            requests.exceptions.ConnectionError,
+            models.Image.create, self.client, b'rootfs', retries=1)
+
+    @mock.patch('pylxd.models.image.time.sleep')
+    def test_create_retry_landed(self, sleep):
+        """An upload that landed despite the error isn't retried."""
+        bodies = self._flaky_create(failures=1)
+
+        a_image = models.Image.create(self.client, b'', retries=3)
+
+        self.assertEqual(1, len(bodies))
+        self.assertEqual(hashlib.sha256(b'').hexdigest(), a_image.fingerprint)
+
+    @mock.patch('pylxd.models.image.time.sleep')
+    def test_create_retry_check_fails(self, sleep):
+        """A failed check for the landed image doesn't end the retries."""
+        bodies = self._flaky_create(failures=1)
+        fingerprint = hashlib.sha256(b'rootfs').hexdigest()
+        self._image_not_found(fingerprint)
+
+        with mock.patch.object(models.Image, 'exists') as exists:
+            exists.side_effect = requests.exceptions.ConnectionError()
+            models.Image.create(self.client, b'rootfs', retries=1)
+
+        self.assertEqual([b'rootfs'] * 2, bodies)
+        exists.assert_called_once_with(self.client, fingerprint)
+
+    def test_fingerprint_split(self):
+        """A split image is fingerprinted as metadata then rootfs."""
+        self.assertEqual(
+            hashlib.sha256(b'metadatarootfs').hexdigest(),
+            image._image_fingerprint(b'rootfs', io.BytesIO(b'metadata')))
+
     def test_update(self):
         """An image is updated."""
         a_image = self.client.images.all()[0]
@@ -187,6 +372,274 @@ class TestImage(testing.PyLXDTestCase):
 
         self.assertEqual(expected, data_sha)
 
+    def test_export_to_path(self):
+        """An image is exported to a path."""
+        a_image = self.client.images.all()[0]
+        target = os.path.join(tempfile.mkdtemp(), 'image.tar')
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+
+        a_image.export(target, chunk_size=100)
+
+        with open(target, 'rb') as f:
+            self.assertEqual(b'0' * 2048, f.read())
+
+    def _split_export_rule(self):
+        encoder = _stream.MultipartEncoder(
+            [('metadata', b'metadata'), ('rootfs', b'rootfs')])
+
+        def export(request, context):
+            context.headers['Content-Type'] = encoder.content_type
+            return b''.join(encoder).decode('utf-8')
+        self.add_rule({
+            'text': export,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855/export$',  # NOQA
+        })
+
+    def test_export_split(self):
+        """A split image is parsed into its metadata and rootfs."""
+        self._split_export_rule()
+        a_image = self.client.images.all()[0]
+        metadata, rootfs = io.BytesIO(), io.BytesIO()
+
+        a_image.export(metadata, rootfs, chunk_size=5)
+
+        self.assertEqual(b'metadata', metadata.getvalue())
+        self.assertEqual(b'rootfs', rootfs.getvalue())
+
+    def test_export_split_without_rootfs_target(self):
+        """The partial export is removed if there's nowhere for the rootfs."""
+        self._split_export_rule()
+        a_image = self.client.images.all()[0]
+        target = os.path.join(tempfile.mkdtemp(), 'meta.tar')
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+
+        self.assertRaises(ValueError, a_image.export, target)
+        self.assertFalse(os.path.exists(target))
+
+    def test_export_verify(self):
+        """An export matching the fingerprint is verified."""
+        self.add_rule({
+            'text': '',
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855/export$',  # NOQA
+        })
+        a_image = self.client.images.all()[0]
+        target = io.BytesIO()
+
+        a_image.export(target, verify=True)
+
+        self.assertEqual(b'', target.getvalue())
+
+    def test_export_verify_mismatch(self):
+        """A corrupt export is removed."""
+        a_image = self.client.images.all()[0]
+        target = os.path.join(tempfile.mkdtemp(), 'image.tar')
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+
+        self.assertRaises(
+            exceptions.ImageFingerprintMismatch,
+            a_image.export, target, verify=True)
+        self.assertFalse(os.path.exists(target))
+
+    def test_export_verify_split(self):
+        """A split image is verified over its metadata and rootfs."""
+        self._split_export_rule()
+        a_image = self.client.images.all()[0]
+
+        with self.assertRaises(exceptions.ImageFingerprintMismatch) as cm:
+            a_image.export(io.BytesIO(), io.BytesIO(), verify=True)
+
+        self.assertEqual(
+            hashlib.sha256(b'metadatarootfs').hexdigest(), cm.exception.actual)
+
+    def test_export_verify_split_without_target(self):
+        """A split image exported whole is verified over its parts."""
+        self._split_export_rule()
+        a_image = self.client.images.all()[0]
+
+        with self.assertRaises(exceptions.ImageFingerprintMismatch) as cm:
+            a_image.export(verify=True, chunk_size=5)
+
+        self.assertEqual(
+            hashlib.sha256(b'metadatarootfs').hexdigest(), cm.exception.actual)
+
+    def _use_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.client.image_cache = image_cache.ImageCache(directory, 2 ** 20)
+        exports = []
+
+        def export(request, context):
+            exports.append(request)
+            return ''
+        self.add_rule({
+            'text': export,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855/export$',  # NOQA
+        })
+        return exports
+
+    def test_export_cached(self):
+        """An image is exported from LXD only once."""
+        exports = self._use_cache()
+        a_image = self.client.images.all()[0]
+
+        a_image.export(io.BytesIO())
+        data = a_image.export()
+
+        self.assertEqual(b'', data.read())
+        self.assertEqual(1, len(exports))
+        self.assertIn(a_image.fingerprint, self.client.image_cache)
+
+    def test_export_cached_split(self):
+        """A cached split image is written to both targets."""
+        self._use_cache()
+        fingerprint = hashlib.sha256(b'').hexdigest()
+        with self.client.image_cache.writing(fingerprint) as paths:
+            for path, data in zip(paths, (b'meta', b'root')):
+                with open(path, 'wb') as f:
+                    f.write(data)
+        a_image = self.client.images.all()[0]
+        metadata, rootfs = io.BytesIO(), io.BytesIO()
+
+        a_image.export(metadata, rootfs)
+
+        self.assertEqual(b'meta', metadata.getvalue())
+        self.assertEqual(b'root', rootfs.getvalue())
+
+    def test_copy_cached(self):
+        """A cached image is uploaded to the new host."""
+        from pylxd.client import Client
+
+        self._use_cache()
+        a_image = self.client.images.all()[0]
+        a_image.export(io.BytesIO())
+        uploads = []
+
+        def upload(request, context):
+            uploads.append(request)
+            context.status_code = 202
+            return json.dumps({
+                'type': 'async', 'operation': 'images-create-operation'})
+        self.add_rule({
+            'text': upload,
+            'method': 'POST',
+            'url': r'^http://pylxd2.test/1.0/images$',
+        })
+        self.add_rule({
+            'text': json.dumps({
+                'type': 'sync',
+                'metadata': {
+                    'id': 'images-create-operation',
+                    'metadata': {'fingerprint': a_image.fingerprint},
+                }}),
+            'method': 'GET',
+            'url': r'^http://pylxd2.test/1.0/operations/images-create-operation$',  # NOQA
+        })
+        self.add_rule({
+            'text': json.dumps({'type': 'sync'}),
+            'method': 'PUT',
+            'url': r'^http://pylxd2.test/1.0/images/e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855$',  # NOQA
+        })
+
+        client2 = Client(endpoint='http://pylxd2.test')
+        copied_image = a_image.copy(client2, wait=True)
+
+        self.assertEqual(a_image.fingerprint, copied_image.fingerprint)
+        self.assertEqual(1, len(uploads))
+
+    def _ranged_export_rule(self, data):
+        ranges = []
+
+        def export(request, context):
+            header = request.headers.get('Range')
+            if header is None:
+                return data
+            start, end = [
+                int(each) for each in header.split('=')[1].split('-')]
+            ranges.append((start, end))
+            context.status_code = 206
+            context.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, len(data))
+            return data[start:end + 1]
+        self.add_rule({
+            'text': export,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855/export$',  # NOQA
+        })
+        return ranges
+
+    def _export_path(self):
+        target = os.path.join(tempfile.mkdtemp(), 'image.tar')
+        self.addCleanup(shutil.rmtree, os.path.dirname(target))
+        return target
+
+    def test_export_ranges(self):
+        """An image is downloaded in concurrent ranges."""
+        data = '0123456789' * 10
+        ranges = self._ranged_export_rule(data)
+        a_image = self.client.images.all()[0]
+        target = self._export_path()
+
+        a_image.export(target, connections=3)
+
+        with open(target, 'rb') as f:
+            self.assertEqual(data.encode('utf-8'), f.read())
+        self.assertEqual(
+            [(0, 0), (0, 33), (34, 67), (68, 99)], sorted(ranges))
+
+    def test_export_ranges_verify(self):
+        """A ranged download is verified after it completes."""
+        self._ranged_export_rule('0123456789')
+        a_image = self.client.images.all()[0]
+        target = self._export_path()
+
+        self.assertRaises(
+            exceptions.ImageFingerprintMismatch,
+            a_image.export, target, verify=True, connections=3)
+        self.assertFalse(os.path.exists(target))
+
+    def test_export_ranges_failure(self):
+        """A failed range waits for the others before the file is removed."""
+        data = '0123456789' * 10
+        finished = []
+
+        def export(request, context):
+            start, end = [
+                int(each)
+                for each in request.headers['Range'].split('=')[1].split('-')]
+            if (start, end) == (0, 33):
+                return data
+            if start:
+                time.sleep(0.1)
+            context.status_code = 206
+            context.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, len(data))
+            finished.append(start)
+            return data[start:end + 1]
+        self.add_rule({
+            'text': export,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images/e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855/export$',  # NOQA
+        })
+        a_image = self.client.images.all()[0]
+        target = self._export_path()
+
+        self.assertRaises(ValueError, a_image.export, target, connections=3)
+        self.assertEqual([0, 34, 68], sorted(finished))
+        self.assertFalse(os.path.exists(target))
+
+    def test_export_ranges_unsupported(self):
+        """Without range support, a single stream is used."""
+        a_image = self.client.images.all()[0]
+        target = self._export_path()
+
+        a_image.export(target, connections=3)
+
+        with open(target, 'rb') as f:
+            self.assertEqual(b'0' * 2048, f.read())
+
     def test_export_not_found(self):
         """LXDAPIException is raised on export of bogus image."""
         def not_found(request, context):
@@ -346,6 +799,61 @@ class TestImage(testing.PyLXDTestCase):
         client2 = Client(endpoint='http://pylxd2.test')
         a_image.copy(client2, public=False, auto_update=False)
 
+    def test_distribute_tree(self):
+        """Hosts that have the image become sources for the next wave."""
+        a_image = self.client.images.all()[0]
+        clients = [mock.Mock(name=str(i)) for i in range(8)]
+        for client in clients:
+            client.api._api_endpoint = 'https://host/1.0'
+        copies = []
+
+        def copy(self, new_client, public=None, auto_update=None,
+                 wait=False):
+            copies.append((self, new_client))
+            return models.Image(new_client, fingerprint=self.fingerprint)
+
+        with mock.patch.object(models.Image, 'copy', copy):
+            results = list(a_image.distribute(clients, max_parallel=2))
+
+        images = dict(results)
+        sources = dict((client, source) for source, client in copies)
+
+        def sources_of(*indexes):
+            return set(sources[clients[i]] for i in indexes)
+
+        def images_of(*indexes):
+            return set(images[clients[i]] for i in indexes)
+
+        self.assertEqual(set(clients), set(images))
+        # The first wave has only this host to pull from, the second two.
+        self.assertEqual(set([a_image]), sources_of(0))
+        self.assertEqual(set([a_image]) | images_of(0), sources_of(1, 2))
+        # Later waves pull from the hosts that received the image last,
+        # leaving this host alone.
+        self.assertEqual(images_of(1, 2), sources_of(3, 4))
+        self.assertEqual(images_of(3, 4), sources_of(5, 6))
+        self.assertTrue(sources_of(7) <= images_of(5, 6))
+
+    def test_distribute_star(self):
+        """Every host pulls from this one."""
+        a_image = self.client.images.all()[0]
+        clients = [mock.Mock() for _ in range(3)]
+
+        with mock.patch.object(models.Image, 'copy') as copy:
+            copy.side_effect = [IOError(), 'image', 'image']
+            results = list(a_image.distribute(
+                clients, max_parallel=1, strategy='star'))
+
+        self.assertEqual(3, copy.call_count)
+        self.assertIsInstance(results[0][1], IOError)
+
+    def test_distribute_unknown_strategy(self):
+        """ValueError is raised for an unknown strategy."""
+        a_image = self.client.images.all()[0]
+
+        self.assertRaises(
+            ValueError, a_image.distribute, [], strategy='random')
+
     def test_create_from_simplestreams(self):
         """Try to create an image from simplestreams."""
         image = self.client.images.create_from_simplestreams(
@@ -357,6 +865,53 @@ class TestImage(testing.PyLXDTestCase):
             image.fingerprint
         )
 
+    def test_create_from_simplestreams_existing(self):
+        """An image LXD already has isn't pulled again."""
+        streams = mock.Mock()
+        streams.resolve.return_value = hashlib.sha256(b'').hexdigest()
+        pulls = []
+        self.add_rule({
+            'text': lambda request, context: pulls.append(request),
+            'method': 'POST',
+            'url': r'^http://pylxd.test/1.0/images$',
+        })
+
+        image = self.client.images.create_from_simplestreams(
+            'https://cloud-images.ubuntu.com/releases', 'trusty/amd64',
+            streams=streams)
+
+        self.assertEqual(
+            hashlib.sha256(b'').hexdigest(), image.fingerprint)
+        self.assertEqual([], pulls)
+        streams.resolve.assert_called_once_with('trusty/amd64', None)
+
+    def test_create_from_simplestreams_resolved(self):
+        """A missing image is pulled by its resolved fingerprint."""
+        mirror = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, mirror)
+        test_simplestreams.write_mirror(mirror)
+        streams = simplestreams.SimpleStreams(
+            simplestreams.DirectoryTransport(mirror))
+        self._image_not_found('ddd')
+        sources = []
+
+        def pull(request, context):
+            sources.append(request.json()['source']['fingerprint'])
+            context.status_code = 202
+            return json.dumps({
+                'type': 'async', 'operation': 'images-create-operation'})
+        self.add_rule({
+            'text': pull,
+            'method': 'POST',
+            'url': r'^http://pylxd.test/1.0/images$',
+        })
+
+        self.client.images.create_from_simplestreams(
+            'https://cloud-images.ubuntu.com/releases', 'trusty/amd64',
+            streams=streams)
+
+        self.assertEqual(['ddd'], sources)
+
     def test_create_from_url(self):
         """Try to create an image from an URL."""
         image = self.client.images.create_from_url(
@@ -366,3 +921,103 @@ class TestImage(testing.PyLXDTestCase):
             'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855',
             image.fingerprint
         )
+
+
+class TestImageCatalog(testing.PyLXDTestCase):
+    """Tests for pylxd.models.image.ImageCatalog."""
+
+    def setUp(self):
+        super(TestImageCatalog, self).setUp()
+        self.images = [
+            self._image('aaaa1', '2016-01-01T00:00:00Z', ['old'],
+                        os='ubuntu', release='16.04'),
+            self._image('aaaa2', '2016-06-01T00:00:00Z', ['xenial'],
+                        os='ubuntu', release='16.04'),
+            self._image('bbbb1', '2016-03-01T00:00:00Z', [],
+                        os='ubuntu', release='14.04'),
+        ]
+        self.requests = []
+
+        def images_GET(request, context):
+            self.requests.append(request)
+            return json.dumps({'type': 'sync', 'metadata': self.images})
+        self.add_rule({
+            'text': images_GET,
+            'method': 'GET',
+            'url': r'^http://pylxd.test/1.0/images\?recursion=1$',
+        })
+
+    def _image(self, fingerprint, created_at, aliases, **properties):
+        return {
+            'fingerprint': fingerprint,
+            'created_at': created_at,
+            'aliases': [{'name': name, 'description': ''} for name in aliases],
+            'properties': properties,
+        }
+
+    def test_get_by_alias(self):
+        """Images are looked up by alias without further requests."""
+        catalog = self.client.images.catalog()
+
+        self.assertEqual(
+            'aaaa2', catalog.get_by_alias('xenial').fingerprint)
+        self.assertIsNone(catalog.get_by_alias('missing'))
+        self.assertEqual(1, len(self.requests))
+
+    def test_get_prefix(self):
+        """Images are looked up by a unique fingerprint prefix."""
+        catalog = self.client.images.catalog()
+
+        self.assertEqual('bbbb1', catalog.get('bb').fingerprint)
+        self.assertEqual('aaaa1', catalog.get('aaaa1').fingerprint)
+        self.assertIsNone(catalog.get('cc'))
+        self.assertRaises(ValueError, catalog.get, 'aaaa')
+
+    def test_find(self):
+        """Images are found by their properties."""
+        catalog = self.client.images.catalog()
+
+        self.assertEqual(
+            ['aaaa1', 'aaaa2'],
+            [image.fingerprint for image in catalog.find(release='16.04')])
+        self.assertEqual(3, len(catalog.find(os='ubuntu')))
+        self.assertEqual([], catalog.find(os='debian'))
+
+    def test_latest(self):
+        """The newest matching image is returned."""
+        catalog = self.client.images.catalog()
+
+        self.assertEqual(
+            'aaaa2', catalog.latest(os='ubuntu', release='16.04').fingerprint)
+        self.assertIsNone(catalog.latest(os='debian'))
+
+    def test_refresh(self):
+        """Refreshing picks up added, changed and removed images."""
+        catalog = self.client.images.catalog()
+        self.images = [
+            self._image('aaaa2', '2016-06-01T00:00:00Z', ['xenial', 'old'],
+                        os='ubuntu', release='16.04'),
+            self._image('cccc1', '2016-07-01T00:00:00Z', [],
+                        os='debian'),
+        ]
+
+        catalog.refresh()
+
+        self.assertIsNone(catalog.get('aaaa1'))
+        self.assertEqual('aaaa2', catalog.get_by_alias('old').fingerprint)
+        self.assertEqual('cccc1', catalog.latest(os='debian').fingerprint)
+        self.assertEqual([], catalog.find(release='14.04'))
+
+    @mock.patch('pylxd.models.image.time.time')
+    def test_max_age(self, time):
+        """A stale catalog is refreshed before a lookup."""
+        time.return_value = 100
+        catalog = self.client.images.catalog(max_age=60)
+        time.return_value = 130
+        catalog.get_by_alias('xenial')
+        self.assertEqual(1, len(self.requests))
+
+        time.return_value = 160
+        catalog.get_by_alias('xenial')
+
+        self.assertEqual(2, len(self.requests))
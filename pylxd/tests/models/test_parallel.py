@@ -0,0 +1,70 @@
+import threading
+import unittest
+
+from pylxd.models import _parallel
+
+
+class TestImapUnordered(unittest.TestCase):
+    """Tests for pylxd.models._parallel.imap_unordered."""
+
+    def test_results(self):
+        """Each item is yielded with its result."""
+        results = _parallel.imap_unordered(lambda x: x * 2, [1, 2, 3], 2)
+
+        self.assertEqual([(1, 2), (2, 4), (3, 6)], sorted(results))
+
+    def test_exception(self):
+        """Exceptions are yielded as results."""
+        error = ValueError()
+
+        def func(item):
+            if item == 2:
+                raise error
+            return item
+
+        results = dict(_parallel.imap_unordered(func, [1, 2, 3], 3))
+
+        self.assertIs(error, results[2])
+        self.assertEqual(3, results[3])
+
+    def test_completion_order(self):
+        """Results are yielded as they complete."""
+        first_done = threading.Event()
+
+        def func(item):
+            if item == 'slow':
+                first_done.wait()
+            return item
+
+        results = _parallel.imap_unordered(func, ['slow', 'fast'], 2)
+
+        self.assertEqual(('fast', 'fast'), next(results))
+        first_done.set()
+        self.assertEqual(('slow', 'slow'), next(results))
+
+    def test_empty(self):
+        """Nothing is yielded for no items."""
+        self.assertEqual(
+            [], list(_parallel.imap_unordered(lambda x: x, [], 2)))
+
+    def test_join(self):
+        """With join, stopping early waits for the calls in progress."""
+        started = threading.Event()
+        finished = []
+
+        def func(item):
+            if item == 'slow':
+                started.set()
+                threading.Event().wait(0.1)
+                finished.append(item)
+            return item
+
+        results = _parallel.imap_unordered(
+            func, ['slow', 'fast'], 2, join=True)
+        for item, _ in results:
+            if item == 'fast':
+                break
+        started.wait()
+        results.close()
+
+        self.assertEqual(['slow'], finished)
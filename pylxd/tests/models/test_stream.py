@@ -0,0 +1,291 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+import six
+
+from pylxd.models import _stream
+
+
+class TestIterChunks(unittest.TestCase):
+    """Tests for pylxd.models._stream.iter_chunks."""
+
+    def test_bytes(self):
+        """Bytes are split into chunks."""
+        chunks = list(_stream.iter_chunks(b'abcdefg', chunk_size=3))
+
+        self.assertEqual([b'abc', b'def', b'g'], chunks)
+
+    def test_text(self):
+        """Text is encoded as utf-8."""
+        chunks = list(_stream.iter_chunks(u'\u2603'))
+
+        self.assertEqual([u'\u2603'.encode('utf-8')], chunks)
+
+    def test_file(self):
+        """File objects are read in chunks."""
+        chunks = list(
+            _stream.iter_chunks(io.BytesIO(b'abcdefg'), chunk_size=4))
+
+        self.assertEqual([b'abcd', b'efg'], chunks)
+
+    def test_iterable(self):
+        """Iterables are passed through."""
+        chunks = list(_stream.iter_chunks(iter([b'abc', b'defg'])))
+
+        self.assertEqual([b'abc', b'defg'], chunks)
+
+
+class TestHashCache(unittest.TestCase):
+    """Tests for pylxd.models._stream.HashCache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.filename = os.path.join(self.directory, 'data')
+        with open(self.filename, 'wb') as f:
+            f.write(b'data')
+
+    def test_digest(self):
+        """The SHA-256 digest of the file is returned."""
+        cache = _stream.HashCache()
+
+        self.assertEqual(
+            hashlib.sha256(b'data').hexdigest(), cache.digest(self.filename))
+
+    def test_digest_cached(self):
+        """An unchanged file isn't read again."""
+        cache = _stream.HashCache()
+        cache.digest(self.filename)
+
+        with mock.patch('pylxd.models._stream.iter_chunks') as iter_chunks:
+            cache.digest(self.filename)
+
+        self.assertFalse(iter_chunks.called)
+
+    def test_save(self):
+        """The cache is persisted to its file."""
+        path = os.path.join(self.directory, 'cache.json')
+        cache = _stream.HashCache(path)
+        cache.digest(self.filename)
+        cache.save()
+
+        with mock.patch('pylxd.models._stream.iter_chunks') as iter_chunks:
+            digest = _stream.HashCache(path).digest(self.filename)
+
+        self.assertFalse(iter_chunks.called)
+        self.assertEqual(hashlib.sha256(b'data').hexdigest(), digest)
+
+
+class TestSharedSource(unittest.TestCase):
+    """Tests for pylxd.models._stream.SharedSource."""
+
+    def test_bytes(self):
+        """Bytes are hashed and shared as they are."""
+        with _stream.SharedSource(b'data') as shared:
+            self.assertEqual(
+                hashlib.sha256(b'data').hexdigest(), shared.sha256)
+            self.assertEqual(b'data', shared.reader().read())
+
+    def test_large_file(self):
+        """Large files are mapped into memory."""
+        data = b'x' * _stream.MMAP_THRESHOLD
+        with tempfile.TemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            f.seek(0)
+            with _stream.SharedSource(f) as shared:
+                reader = shared.reader()
+
+                self.assertEqual(len(data), len(reader))
+                self.assertEqual(b'xxx', reader.read(3))
+                self.assertEqual(
+                    hashlib.sha256(data).hexdigest(), shared.sha256)
+
+    def test_large_file_position(self):
+        """Large files are read from their current position."""
+        data = b'x' * _stream.MMAP_THRESHOLD
+        with tempfile.TemporaryFile() as f:
+            f.write(b'header' + data)
+            f.flush()
+            f.seek(6)
+            with _stream.SharedSource(f) as shared:
+                reader = shared.reader()
+
+                self.assertEqual(len(data), len(reader))
+                self.assertEqual(data, reader.read())
+                self.assertEqual(
+                    hashlib.sha256(data).hexdigest(), shared.sha256)
+
+    def test_readers(self):
+        """Each reader has its own position."""
+        shared = _stream.SharedSource(io.BytesIO(b'data'))
+        first = shared.reader()
+        first.read(2)
+
+        self.assertEqual(b'data', shared.reader().read())
+        self.assertEqual(b'ta', first.read())
+
+
+class TestPayload(unittest.TestCase):
+    """Tests for pylxd.models._stream.Payload."""
+
+    def test_bytes(self):
+        """Bytes are sized and chunked."""
+        payload = _stream.Payload(b'abcdefg', chunk_size=4)
+
+        self.assertEqual(7, len(payload))
+        self.assertEqual([b'abcd', b'efg'], list(payload))
+
+    def test_text(self):
+        """Text is content, encoded as utf-8, not a path."""
+        payload = _stream.Payload(u'caf\xe9')
+
+        self.assertEqual(5, len(payload))
+        self.assertEqual([b'caf\xc3\xa9'], list(payload))
+
+    def test_path(self):
+        """A local path is read when iterated over."""
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'data')
+            f.flush()
+            payload = _stream.Payload.from_path(f.name)
+
+            self.assertEqual(4, len(payload))
+            self.assertEqual([b'data'], list(payload))
+
+    def test_read(self):
+        """A payload can be read in blocks, and rewound."""
+        payload = _stream.Payload(b'abcdefg', chunk_size=3)
+
+        self.assertEqual(b'ab', payload.read(2))
+        self.assertEqual(b'cdefg', payload.read(10))
+        self.assertEqual(b'', payload.read(10))
+        payload.rewind()
+        self.assertEqual(b'abcdefg', payload.read())
+
+    def test_file(self):
+        """A file object is read from its position, more than once."""
+        source = io.BytesIO(b'skip data')
+        source.seek(5)
+        payload = _stream.Payload(source)
+
+        self.assertEqual(4, len(payload))
+        self.assertEqual([b'data'], list(payload))
+        self.assertEqual([b'data'], list(payload))
+
+    def test_unseekable(self):
+        """Unseekable file objects are rejected."""
+        source = mock.Mock()
+        source.seekable.return_value = False
+
+        self.assertRaises(ValueError, _stream.Payload, source)
+
+
+class TestMultipartEncoder(unittest.TestCase):
+    """Tests for pylxd.models._stream.MultipartEncoder."""
+
+    def test_body(self):
+        """The parts are encoded as multipart/form-data."""
+        encoder = _stream.MultipartEncoder(
+            [('metadata', b'meta'), ('rootfs', io.BytesIO(b'root'))])
+        boundary = encoder.content_type.split('boundary=')[1]
+
+        body = b''.join(encoder)
+
+        self.assertEqual(len(body), len(encoder))
+        self.assertEqual(six.b(
+            '--{0}\r\n'
+            'Content-Disposition:form-data;name=metadata;filename=metadata'
+            '\r\nContent-Type: application/octet-stream\r\n\r\n'
+            'meta\r\n'
+            '--{0}\r\n'
+            'Content-Disposition:form-data;name=rootfs;filename=rootfs'
+            '\r\nContent-Type: application/octet-stream\r\n\r\n'
+            'root\r\n'
+            '--{0}--\r\n\r\n'.format(boundary)), body)
+
+    def test_read(self):
+        """The body can be read in blocks, as httplib reads it."""
+        encoder = _stream.MultipartEncoder(
+            [('metadata', b'meta'), ('rootfs', io.BytesIO(b'root'))])
+        body = b''.join(encoder)
+
+        blocks = iter(lambda: encoder.read(7), b'')
+
+        self.assertEqual(body, b''.join(blocks))
+
+
+class TestMultipartParser(unittest.TestCase):
+    """Tests for pylxd.models._stream.MultipartParser."""
+
+    def _parse(self, body, boundary, chunk_size):
+        parts = {}
+
+        def open_part(name):
+            parts[name] = io.BytesIO()
+            return parts[name]
+        parser = _stream.MultipartParser(boundary, open_part)
+        for offset in range(0, len(body), chunk_size):
+            parser.feed(body[offset:offset + chunk_size])
+        parser.close()
+        return dict((name, f.getvalue()) for name, f in parts.items())
+
+    def test_parse(self):
+        """Parts are parsed however the body is chunked."""
+        rootfs = b'\r\n--' + b'x' * 100
+        encoder = _stream.MultipartEncoder(
+            [('metadata', b'meta'), ('rootfs', rootfs)])
+        body = b''.join(encoder)
+        boundary = _stream.multipart_boundary(encoder.content_type)
+
+        for chunk_size in (1, 3, 7, 64, len(body)):
+            self.assertEqual(
+                {'metadata': b'meta', 'rootfs': rootfs},
+                self._parse(body, boundary, chunk_size))
+
+    def test_incomplete(self):
+        """ValueError is raised if the body is cut short."""
+        encoder = _stream.MultipartEncoder([('metadata', b'meta')])
+        body = b''.join(encoder)
+        boundary = _stream.multipart_boundary(encoder.content_type)
+
+        self.assertRaises(
+            ValueError, self._parse, body[:-10], boundary, 4)
+
+    def test_boundary(self):
+        """The boundary is read from the content type."""
+        self.assertEqual(
+            b'abc',
+            _stream.multipart_boundary('multipart/form-data; boundary="abc"'))
+        self.assertIsNone(
+            _stream.multipart_boundary('application/octet-stream'))
+
+
+class TestPwrite(unittest.TestCase):
+    """Tests for pylxd.models._stream.pwrite."""
+
+    def _write(self):
+        with tempfile.TemporaryFile() as f:
+            f.truncate(6)
+            lock = threading.Lock()
+            _stream.pwrite(f.fileno(), b'def', 3, lock)
+            _stream.pwrite(f.fileno(), b'abc', 0, lock)
+            f.seek(0)
+            return f.read()
+
+    def test_pwrite(self):
+        """Data is written at its offset."""
+        self.assertEqual(b'abcdef', self._write())
+
+    def test_pwrite_fallback(self):
+        """Without os.pwrite, the file position is moved under the lock."""
+        with mock.patch(
+                'pylxd.models._stream.hasattr', create=True,
+                return_value=False):
+            self.assertEqual(b'abcdef', self._write())
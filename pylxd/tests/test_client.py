@@ -225,6 +225,40 @@ class TestClient(unittest.TestCase):
 
         WebsocketClient.assert_called_once_with('wss://lxd.local')
 
+    def test_reactor(self):
+        """The client's reactor is created once."""
+        an_client = client.Client()
+
+        self.assertIs(an_client.reactor, an_client.reactor)
+
+    @requires_ws4py
+    @mock.patch('pylxd.client._EventsWebsocketClient.connect')
+    def test_watch_events(self, connect):
+        """Events are watched from the client's reactor."""
+        an_client = client.Client()
+
+        ws_client = an_client.watch_events()
+
+        self.assertEqual('/1.0/events', ws_client.resource)
+        self.assertIs(an_client.reactor, ws_client.reactor)
+        connect.assert_called_once_with()
+
+    @requires_ws4py
+    @mock.patch('pylxd.client._EventsWebsocketClient.connect')
+    def test_watch_events_handler(self, connect):
+        """Events are passed to the handler, or queued."""
+        from ws4py.messaging import TextMessage
+        handler = mock.Mock()
+        an_client = client.Client()
+        handled = an_client.watch_events(handler=handler)
+        queued = an_client.watch_events()
+
+        handled.received_message(TextMessage(b'{"type": "logging"}'))
+        queued.received_message(TextMessage(b'{"type": "operation"}'))
+
+        handler.assert_called_once_with({'type': 'logging'})
+        self.assertEqual({'type': 'operation'}, queued.queue.get_nowait())
+
 
 class TestAPINode(unittest.TestCase):
     """Tests for pylxd.client._APINode."""
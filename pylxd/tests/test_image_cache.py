@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pylxd import image_cache
+
+
+class TestImageCache(unittest.TestCase):
+    """Tests for pylxd.image_cache.ImageCache."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = image_cache.ImageCache(self.directory, max_size=10)
+
+    def _add(self, fingerprint, data, rootfs=None):
+        with self.cache.writing(fingerprint) as (path, rootfs_path):
+            with open(path, 'wb') as f:
+                f.write(data)
+            if rootfs is not None:
+                with open(rootfs_path, 'wb') as f:
+                    f.write(rootfs)
+
+    def test_get(self):
+        """An added image is returned."""
+        self._add('abc', b'data')
+
+        path, rootfs_path = self.cache.get('abc')
+
+        self.assertIsNone(rootfs_path)
+        with open(path, 'rb') as f:
+            self.assertEqual(b'data', f.read())
+
+    def test_get_split(self):
+        """A split image is returned as its metadata and rootfs."""
+        self._add('abc', b'meta', b'root')
+
+        path, rootfs_path = self.cache.get('abc')
+
+        self.assertEqual(os.path.join(self.directory, 'abc.metadata'), path)
+        self.assertEqual(
+            os.path.join(self.directory, 'abc.rootfs'), rootfs_path)
+
+    def test_open(self):
+        """Opened files can be read after the image is evicted."""
+        self._add('abc', b'meta', b'root')
+        f, rootfs = self.cache.open('abc')
+        self.addCleanup(f.close)
+        self.addCleanup(rootfs.close)
+
+        self._add('def', b'x' * 20)
+
+        self.assertNotIn('abc', self.cache)
+        self.assertEqual(b'meta', f.read())
+        self.assertEqual(b'root', rootfs.read())
+
+    def test_open_missing(self):
+        """None is returned when opening an image that isn't cached."""
+        self.assertIsNone(self.cache.open('abc'))
+
+    def test_get_missing(self):
+        """None is returned for an image that isn't cached."""
+        self.assertIsNone(self.cache.get('abc'))
+        self.assertNotIn('abc', self.cache)
+
+    def test_writing_failure(self):
+        """Nothing is cached if writing fails."""
+        try:
+            with self.cache.writing('abc') as (path, _):
+                with open(path, 'wb') as f:
+                    f.write(b'partial')
+                raise IOError()
+        except IOError:
+            pass
+
+        self.assertNotIn('abc', self.cache)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_evict(self):
+        """The least recently used images are evicted."""
+        self._add('abc', b'1234')
+        self._add('def', b'1234')
+        os.utime(os.path.join(self.directory, 'abc'), (1, 1))
+        os.utime(os.path.join(self.directory, 'def'), (2, 2))
+        self.cache.get('abc')
+
+        self._add('ghi', b'1234')
+
+        self.assertIn('abc', self.cache)
+        self.assertNotIn('def', self.cache)
+        self.assertIn('ghi', self.cache)
+
+    def test_evict_keeps_new(self):
+        """An image bigger than the cache is still kept until the next."""
+        self._add('abc', b'x' * 20)
+
+        self.assertIn('abc', self.cache)
@@ -0,0 +1,74 @@
+import socket
+import threading
+import unittest
+
+from pylxd import reactor
+
+
+class FakeWebsocket(object):
+    """Enough of a ws4py websocket to be served by a reactor."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.terminated = False
+        self.received = []
+        self.closed = threading.Event()
+
+    def once(self):
+        data = self.sock.recv(1024)
+        if not data:
+            return False
+        self.received.append(data)
+        return True
+
+    def terminate(self):
+        self.terminated = True
+        self.closed.set()
+
+
+class TestWebsocketReactor(unittest.TestCase):
+    """Tests for pylxd.reactor.WebsocketReactor."""
+
+    def setUp(self):
+        self.reactor = reactor.WebsocketReactor()
+        self.addCleanup(self.reactor.stop)
+
+    def socketpair(self):
+        local, remote = socket.socketpair()
+        self.addCleanup(local.close)
+        self.addCleanup(remote.close)
+        return FakeWebsocket(local), remote
+
+    def test_dispatch(self):
+        """Websockets are terminated and removed when their socket closes."""
+        websockets = []
+        for _ in range(3):
+            websocket, remote = self.socketpair()
+            self.reactor.add(websocket)
+            remote.sendall(b'data')
+            remote.shutdown(socket.SHUT_WR)
+            websockets.append(websocket)
+
+        for websocket in websockets:
+            self.assertTrue(websocket.closed.wait(5))
+            self.assertEqual(b'data', b''.join(websocket.received))
+            self.assertNotIn(websocket, self.reactor)
+        self.assertEqual(0, len(self.reactor))
+
+    def test_remove(self):
+        """Removed websockets are no longer served."""
+        websocket, remote = self.socketpair()
+        self.reactor.add(websocket)
+
+        self.reactor.remove(websocket)
+
+        self.assertNotIn(websocket, self.reactor)
+
+    def test_stop(self):
+        """Stopping the reactor terminates its websockets."""
+        websocket, remote = self.socketpair()
+        self.reactor.add(websocket)
+
+        self.reactor.stop()
+
+        self.assertTrue(websocket.terminated)
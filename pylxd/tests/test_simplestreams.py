@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pylxd import simplestreams
+from pylxd.tests import testing
+
+
+def _product(arch, aliases, *fingerprints):
+    return {
+        'arch': arch,
+        'aliases': aliases,
+        'versions': dict(
+            ('2016060{}'.format(i), {'items': {
+                'lxd.tar.xz': {
+                    'ftype': 'lxd.tar.xz',
+                    'combined_squashfs_sha256': fingerprint,
+                }}})
+            for i, fingerprint in enumerate(fingerprints)),
+    }
+
+
+INDEX = {
+    'index': {
+        'images': {
+            'datatype': 'image-downloads',
+            'path': 'streams/v1/images.json',
+        },
+    },
+}
+
+PRODUCTS = {
+    'products': {
+        'ubuntu:xenial:amd64': _product(
+            'amd64', 'ubuntu/16.04, xenial', 'aaa', 'bbb'),
+        'ubuntu:xenial:arm64': _product(
+            'arm64', 'ubuntu/16.04, xenial', 'ccc'),
+        'ubuntu:trusty:amd64': _product('amd64', 'trusty', 'ddd'),
+    },
+}
+
+
+def write_mirror(directory):
+    """Write a simplestreams mirror of `PRODUCTS` to `directory`."""
+    os.makedirs(os.path.join(directory, 'streams', 'v1'))
+    for name, content in (('index', INDEX), ('images', PRODUCTS)):
+        path = os.path.join(directory, 'streams', 'v1', name + '.json')
+        with open(path, 'w') as f:
+            json.dump(content, f)
+
+
+class TestSimpleStreams(unittest.TestCase):
+    """Tests for pylxd.simplestreams.SimpleStreams."""
+
+    def setUp(self):
+        self.mirror = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.mirror)
+        write_mirror(self.mirror)
+        self.transport = simplestreams.DirectoryTransport(self.mirror)
+
+    def test_resolve(self):
+        """An alias resolves to the fingerprint of its latest version."""
+        streams = simplestreams.SimpleStreams(self.transport)
+
+        self.assertEqual('bbb', streams.resolve('xenial', 'amd64'))
+        self.assertEqual('ccc', streams.resolve('ubuntu/16.04', 'arm64'))
+        self.assertEqual('ddd', streams.resolve('trusty'))
+
+    def test_resolve_architecture_alias(self):
+        """An alias may name its architecture, as LXD's do."""
+        streams = simplestreams.SimpleStreams(self.transport)
+
+        self.assertEqual('ccc', streams.resolve('xenial/arm64'))
+        self.assertEqual('ddd', streams.resolve('trusty/amd64', 'arm64'))
+        self.assertEqual('bbb', streams.resolve('ubuntu/16.04/amd64'))
+
+    def test_resolve_missing(self):
+        """None is returned for an unknown alias."""
+        streams = simplestreams.SimpleStreams(self.transport)
+
+        self.assertIsNone(streams.resolve('bionic', 'amd64'))
+
+    def test_resolve_ambiguous(self):
+        """ValueError is raised if the architecture is needed."""
+        streams = simplestreams.SimpleStreams(self.transport)
+
+        self.assertRaises(ValueError, streams.resolve, 'xenial')
+
+    def test_cache(self):
+        """Unchanged files are read from the cache."""
+        cache_dir = os.path.join(self.mirror, 'cache')
+        simplestreams.SimpleStreams(
+            self.transport, cache_dir=cache_dir).products()
+        transport = mock.Mock()
+        transport.fetch.return_value = simplestreams.StreamResponse(
+            None, None, None)
+        streams = simplestreams.SimpleStreams(transport, cache_dir=cache_dir)
+
+        self.assertEqual('bbb', streams.resolve('xenial', 'amd64'))
+        self.assertIsNotNone(transport.fetch.call_args[1]['last_modified'])
+
+    def test_directory_not_modified(self):
+        """An unchanged file in a mirror isn't read again."""
+        response = self.transport.fetch(simplestreams.INDEX_PATH)
+
+        self.assertIsNone(self.transport.fetch(
+            simplestreams.INDEX_PATH,
+            last_modified=response.last_modified).content)
+
+
+class TestHTTPTransport(testing.PyLXDTestCase):
+    """Tests for pylxd.simplestreams.HTTPTransport."""
+
+    def setUp(self):
+        super(TestHTTPTransport, self).setUp()
+        self.requests = []
+
+        def index(request, context):
+            self.requests.append(request)
+            if request.headers.get('If-None-Match') == '"v1"':
+                context.status_code = 304
+                return ''
+            context.headers['ETag'] = '"v1"'
+            return json.dumps(INDEX)
+        self.add_rule({
+            'text': index,
+            'method': 'GET',
+            'url': r'^https://images.test/streams/v1/index.json$',
+        })
+
+    def test_etag(self):
+        """A cached file is revalidated with its ETag."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        transport = simplestreams.HTTPTransport('https://images.test/')
+
+        for _ in range(2):
+            streams = simplestreams.SimpleStreams(
+                transport, cache_dir=cache_dir)
+            self.assertEqual(INDEX, streams.index())
+
+        self.assertNotIn('If-None-Match', self.requests[0].headers)
+        self.assertEqual('"v1"', self.requests[1].headers['If-None-Match'])